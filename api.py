@@ -0,0 +1,324 @@
+import argparse
+import io
+import time
+from dataclasses import dataclass
+
+import autoselect
+import huffman
+import instrument
+import lz77
+from instrument import count, stage
+from arithmetic import (
+    AdaptiveArithmeticDecoder,
+    AdaptiveArithmeticEncoder,
+    ArithmeticCodingDecoder,
+    ArithmeticCodingEncoder,
+    ContextCodingDecoder,
+    ContextCodingEncoder,
+    RangeCodingDecoder,
+    RangeCodingEncoder,
+    RansCodingDecoder,
+    RansCodingEncoder,
+)
+from lzw import LZWCompressor
+
+
+@dataclass
+class CompressionResult:
+    codec: str
+    input_size: int
+    output_size: int
+    seconds: float
+
+    @property
+    def ratio(self):
+        return self.input_size / self.output_size if self.output_size else 0
+
+
+class Codec:
+    # bytes in, bytes out; codecs that can really stream override the *_stream methods
+    name = None
+    codec_id = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+    def compress_block(self, data):
+        # (codec that coded the block, payload); AutoCodec may hand back another codec
+        return self, self.compress(data)
+
+    def compress_stream(self, src, dst):
+        data = src.read()
+        out = self.compress(data)
+        dst.write(out)
+        return len(data), len(out)
+
+    def decompress_stream(self, src, dst):
+        data = src.read()
+        out = self.decompress(data)
+        dst.write(out)
+        return len(data), len(out)
+
+
+class CountingReader:
+    # counts the bytes read from src, which may be a pipe that cannot tell()
+
+    def __init__(self, src):
+        self.src = src
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.src.read(size)
+        self.count += len(data)
+        return data
+
+
+class StreamingCodec(Codec):
+    # bytes interface on top of a native stream implementation
+
+    def compress(self, data):
+        dst = io.BytesIO()
+        self.compress_stream(io.BytesIO(data), dst)
+        return dst.getvalue()
+
+    def decompress(self, data):
+        dst = io.BytesIO()
+        self.decompress_stream(io.BytesIO(data), dst)
+        return dst.getvalue()
+
+
+class StoredCodec(Codec):
+    # raw copy, the fallback for incompressible blocks
+
+    def compress(self, data):
+        return bytes(data)
+
+    def decompress(self, data):
+        return bytes(data)
+
+
+class HuffmanCodec(Codec):
+    def __init__(self, block_size=None, workers=1):
+        self.block_size = block_size
+        self.workers = workers
+
+    def compress(self, data):
+        return huffman.compress_bytes(data, self.block_size, self.workers)
+
+    def decompress(self, data):
+        return huffman.decompress_bytes(data, self.workers)
+
+    def decompress_stream(self, src, dst):
+        src = CountingReader(src)
+        written = 0
+        for chunk in huffman.iter_decompress_stream(src, self.workers):
+            dst.write(chunk)
+            written += len(chunk)
+        return src.count, written
+
+
+class ArithmeticCodec(Codec):
+    ENGINES = {
+        "bit": (ArithmeticCodingEncoder, ArithmeticCodingDecoder),
+        "range": (RangeCodingEncoder, RangeCodingDecoder),
+        "rans": (RansCodingEncoder, RansCodingDecoder),
+    }
+
+    def __init__(self, precision=32, engine="bit"):
+        self.precision = precision
+        self.encoder_cls, self.decoder_cls = self.ENGINES[engine]
+
+    def compress(self, data):
+        return self.encoder_cls(None, None, self.precision, data=data).encode_bytes()
+
+    def decompress(self, data):
+        return self.decoder_cls(None, None, self.precision, raw=data).decode_bytes()
+
+
+class AdaptiveArithmeticCodec(StreamingCodec):
+    def __init__(self, precision=32):
+        self.precision = precision
+
+    def compress_stream(self, src, dst):
+        return AdaptiveArithmeticEncoder(None, None, self.precision).encode_stream(src, dst)
+
+    def decompress_stream(self, src, dst):
+        src = CountingReader(src)
+        written = AdaptiveArithmeticDecoder(None, None, self.precision).decode_stream(src, dst)
+        return src.count, written
+
+
+class ContextCodec(Codec):
+    def __init__(self, order=2, table_bits=16):
+        self.order = order
+        self.table_bits = table_bits
+
+    def compress(self, data):
+        return ContextCodingEncoder(None, None, self.order, self.table_bits, data=data).encode_bytes()
+
+    def decompress(self, data):
+        return ContextCodingDecoder(None, None, raw=data).decode_bytes()
+
+
+class LZWCodec(StreamingCodec):
+    def __init__(self, max_bits=16):
+        self.lzw = LZWCompressor(max_bits)
+
+    def compress_stream(self, src, dst):
+        return self.lzw.compress_stream(src, dst)
+
+    def decompress_stream(self, src, dst):
+        src = CountingReader(src)
+        written = self.lzw.decompress_stream(src, dst)
+        return src.count, written
+
+
+class PipelineCodec(Codec):
+    # LZ77 match/literal streams, each entropy-coded in memory by another registered codec
+
+    def __init__(self, coder):
+        self.coder = coder
+
+    def compress(self, data):
+        return lz77.encode(data, get_codec(self.coder))
+
+    def decompress(self, data):
+        return lz77.decode(data, get_codec(self.coder))
+
+
+class AutoCodec(Codec):
+    # picks a codec per call from a cheap size/speed estimate and prefixes its id
+
+    def __init__(self, speed_weight=autoselect.DEFAULT_SPEED_WEIGHT, candidates=None):
+        self.speed_weight = speed_weight
+        self.candidates = candidates
+
+    def compress_block(self, data):
+        # walk down the ranking only while a codec badly misses its estimate;
+        # "stored" never misses, so with it among the candidates nothing expands past it
+        best = None
+        with stage("auto.estimate"):
+            ranking = autoselect.rank_codecs(data, self.speed_weight, self.candidates)
+        for name, predicted in ranking:
+            count(f"auto.tried.{name}")
+            codec = get_codec(name)
+            payload = codec.compress(data)
+            if best is None or len(payload) < len(best[1]):
+                best = codec, payload
+            if len(payload) <= predicted * (1 + autoselect.MISPREDICT_MARGIN) + 16:
+                break
+        return best
+
+    def compress(self, data):
+        codec, payload = self.compress_block(data)
+        return bytes([codec.codec_id]) + payload
+
+    def decompress(self, data):
+        return get_codec_by_id(data[0]).decompress(data[1:])
+
+
+_codecs = {}
+_codec_ids = {}
+
+def register_codec(name, codec, codec_id=None):
+    # codec_id is the number stored in container headers, it must never be reused
+    if codec_id is not None:
+        if codec_id in _codec_ids and _codec_ids[codec_id].name != name:
+            raise ValueError(f"Codec id {codec_id} already used by {_codec_ids[codec_id].name}")
+        _codec_ids[codec_id] = codec
+    codec.name = name
+    codec.codec_id = codec_id
+    _codecs[name] = codec
+    return codec
+
+def get_codec(name):
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec: {name} (available: {', '.join(available_codecs())})") from None
+
+def get_codec_by_id(codec_id):
+    try:
+        return _codec_ids[codec_id]
+    except KeyError:
+        raise ValueError(f"Unknown codec id: {codec_id}") from None
+
+def available_codecs():
+    return sorted(_codecs)
+
+def compress(data, codec="huffman"):
+    with stage(f"api.{codec}.compress"):
+        out = get_codec(codec).compress(data)
+    count(f"api.{codec}.bytes_in", len(data))
+    count(f"api.{codec}.bytes_out", len(out))
+    return out
+
+def decompress(data, codec="huffman"):
+    with stage(f"api.{codec}.decompress"):
+        return get_codec(codec).decompress(data)
+
+def compress_stream(src, dst, codec="huffman"):
+    start = time.perf_counter()
+    with stage(f"api.{codec}.compress"):
+        input_size, output_size = get_codec(codec).compress_stream(src, dst)
+    count(f"api.{codec}.bytes_in", input_size)
+    count(f"api.{codec}.bytes_out", output_size)
+    return CompressionResult(codec, input_size, output_size, time.perf_counter() - start)
+
+def decompress_stream(src, dst, codec="huffman"):
+    start = time.perf_counter()
+    with stage(f"api.{codec}.decompress"):
+        input_size, output_size = get_codec(codec).decompress_stream(src, dst)
+    return CompressionResult(codec, input_size, output_size, time.perf_counter() - start)
+
+
+# the arithmetic defaults use 32-bit precision so large inputs never run out of range
+register_codec("stored", StoredCodec(), 0)
+register_codec("huffman", HuffmanCodec(), 1)
+register_codec("arithmetic", ArithmeticCodec(), 2)
+register_codec("arithmetic-adaptive", AdaptiveArithmeticCodec(), 3)
+register_codec("range", ArithmeticCodec(engine="range"), 4)
+register_codec("ppm", ContextCodec(), 5)
+register_codec("lzw", LZWCodec(), 6)
+register_codec("auto", AutoCodec(), 7)
+register_codec("rans", ArithmeticCodec(engine="rans"), 8)
+# pipeline presets, named <parse>+<entropy coder>
+register_codec("lz+huff", PipelineCodec("huffman"), 9)
+register_codec("lz+range", PipelineCodec("range"), 10)
+register_codec("lz+rans", PipelineCodec("rans"), 11)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compression tool for every registered codec")
+    parser.add_argument("mode", choices=["compress", "decompress", "list"], help="Mode of operation")
+    parser.add_argument("input", nargs="?", help="Input file path")
+    parser.add_argument("output", nargs="?", help="Output file path")
+    parser.add_argument("--codec", default="huffman", help="Codec name, see 'list' (default: huffman)")
+    parser.add_argument("--speed-weight", type=float, default=autoselect.DEFAULT_SPEED_WEIGHT,
+                        help="auto codec only: 0 picks the smallest output, larger values favour faster codecs "
+                             f"(default: {autoselect.DEFAULT_SPEED_WEIGHT})")
+    instrument.add_arguments(parser)
+
+    args = parser.parse_args()
+    instrument.configure(args)
+    get_codec("auto").speed_weight = args.speed_weight
+
+    if args.mode == "list":
+        for name in available_codecs():
+            print(name)
+    else:
+        if args.input is None or args.output is None:
+            parser.error("compress and decompress need an input and an output path")
+        run = compress_stream if args.mode == "compress" else decompress_stream
+        with open(args.input, 'rb') as src, open(args.output, 'wb') as dst:
+            result = run(src, dst, args.codec)
+
+        print(f"{args.mode.capitalize()}ed '{args.input}' : '{args.output}' with {result.codec}")
+        print(f"Time taken: {result.seconds:.4f} seconds")
+        print(f"Input size: {result.input_size} bytes")
+        print(f"Output size: {result.output_size} bytes")
+        if args.mode == "compress":
+            print(f"Compression ratio: {result.ratio:.2f}")
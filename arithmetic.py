@@ -1,26 +1,70 @@
 import argparse
-import json
-import heapq
-from pathlib import Path
-from collections import defaultdict, Counter
 import time
-import os
+import sys
+from array import array
+from bisect import bisect_right
 from bitarray import bitarray
+from fileio import CHUNK_SIZE, map_file, write_chunks
+import huffman
+import instrument
+from instrument import count, stage, timed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class ArithmeticCodingEncoder:
-    def __init__(self, input_path, output_path, precision=16):
+    STAGE = "arithmetic.bit"
+
+    def __init__(self, input_path, output_path, precision=16, data=None):
+        self.start_time = time.time()  # the frequency pass below counts towards the reported time
         self.input_path = input_path
-        self.data = Path(input_path).read_bytes()
+        self.data = map_file(input_path) if data is None else data
         self.num_bytes = len(self.data)
-        self.frequencies = self.build_frequency_table()
-        self.probs = {byte: freq / self.num_bytes for byte, freq in self.frequencies.items()}
-        self.unique_chars = sorted(self.frequencies.keys())
-        self.cum_freq = self.build_cumulative_freq_table()
+        with stage("arithmetic.frequency"):
+            self.frequencies = self.build_frequency_table()
+            self.probs = {byte: freq / self.num_bytes for byte, freq in self.frequencies.items()}
+            self.unique_chars = sorted(self.frequencies.keys())
+            self.cum_freq = self.build_cumulative_freq_table()
         self.precision = precision
         self.output_path = output_path
 
     def encode(self):
+        start_time = self.start_time
+        compressed_size = write_chunks(self.output_path, [self.header_bytes(), self.timed_payload()])
+
+        end_time = time.time()
+        original_size = self.num_bytes
+
+        compression_ratio = original_size / compressed_size if compressed_size != 0 else 0
+
+        print(f"Compressed '{self.input_path}' : '{self.output_path}'")
+        print(f"Time taken: {end_time - start_time:.4f} seconds")
+        print(f"Original size: {original_size} bytes")
+        print(f"Compressed size: {compressed_size} bytes")
+        print(f"diff in size: {original_size - compressed_size} bytes")
+        print(f"Compression ratio: {compression_ratio:.2f}")
+
+    def header_bytes(self):
+        header = bytearray(len(self.unique_chars).to_bytes(2, 'big'))
+        for byte, freq in self.frequencies.items():
+            header.append(byte)                 # 1 byte
+            header += freq.to_bytes(4, 'big')   # 4 bytes
+        header += self.num_bytes.to_bytes(4, 'big')
+        return bytes(header)
+
+    def encode_bytes(self):
+        return self.header_bytes() + self.timed_payload()
+
+    def timed_payload(self):
+        with stage(self.STAGE + ".encode"):
+            payload = self.encode_payload()
+        count(self.STAGE + ".symbols", self.num_bytes)
+        return payload
+
+    def encode_payload(self):
         bits = bitarray()
         whole = 1 << self.precision        # 2^32
         half = whole >> 1             # 2^31
@@ -30,7 +74,6 @@ class ArithmeticCodingEncoder:
         upper_limit = whole
         rem_bits = 0
 
-        start_time = time.time()
         for byte in self.data:
             range_ = upper_limit - lower_limit
             sym_low, sym_high = self.cum_freq[byte]
@@ -71,33 +114,12 @@ class ArithmeticCodingEncoder:
             for _ in range(rem_bits):
                 self.output_bit(bits, 0)
 
-
-        with open(self.output_path, 'wb') as f:
-            num_symbols = len(self.unique_chars)
-            f.write(num_symbols.to_bytes(2, 'big'))
-            for byte, freq in self.frequencies.items():
-                f.write(bytes([byte]))              # 1 byte
-                f.write(freq.to_bytes(4, 'big'))    # 4 bytes
-            f.write(self.num_bytes.to_bytes(4, 'big'))
-            f.write(bits)
-
-        end_time = time.time()
-        original_size = self.num_bytes
-        compressed_size = os.path.getsize(self.output_path)
-
-        compression_ratio = original_size / compressed_size if compressed_size != 0 else 0
-
-        print(f"Compressed '{self.input_path}' : '{self.output_path}'")
-        print(f"Time taken: {end_time - start_time:.4f} seconds")
-        print(f"Original size: {original_size} bytes")
-        print(f"Compressed size: {compressed_size} bytes")
-        print(f"diff in size: {original_size - compressed_size} bytes")
-        print(f"Compression ratio: {compression_ratio:.2f}")
+        bits.fill()  # zero the pad bits, the raw buffer is written as is
+        return bits
 
 
     def build_frequency_table(self):
-        frequencies = Counter(self.data)
-        return dict(frequencies)
+        return huffman.build_frequency_table(self.data)
 
     def build_cumulative_freq_table(self):
         cum_freq = {}
@@ -112,14 +134,36 @@ class ArithmeticCodingEncoder:
         bits.append(bool(value))
 
 class ArithmeticCodingDecoder:
-    def __init__(self, input_path,output_path, precision=16):
-        self.frequencies, self.num_bytes, self.data = self.read_file(input_path)
-        self.unique_chars = sorted(self.frequencies.keys())
-        self.cum_freq = self.build_cumulative_freq_table()
+    STAGE = "arithmetic.bit"
+
+    def __init__(self, input_path, output_path, precision=16, raw=None):
+        self.start_time = time.time()
+        with stage("arithmetic.parse"):
+            if raw is None:
+                self.frequencies, self.num_bytes, self.data = self.read_file(input_path)
+            else:
+                self.frequencies, self.num_bytes, self.data = self.parse(raw)
+            self.unique_chars = sorted(self.frequencies.keys())
+            self.cum_freq = self.build_cumulative_freq_table()
         self.precision = precision
         self.output_path = output_path
 
     def decode(self):
+        start_time = self.start_time
+        decompressed_size = write_chunks(self.output_path, timed(self.STAGE + ".decode", self.decode_chunks()))
+
+        end_time = time.time()
+
+        print(f"Time taken: {end_time - start_time:.4f} seconds")
+        print(f"Decompressed size: {decompressed_size} bytes")
+
+    def decode_bytes(self):
+        return b''.join(timed(self.STAGE + ".decode", self.decode_chunks()))
+
+    def decode_chunks(self):
+        # yields the output in pieces of about CHUNK_SIZE bytes
+        if self.num_bytes == 0:
+            return
         bits = bitarray()
         bits.frombytes(self.data)
         whole = 1 << self.precision        # 2^32
@@ -129,8 +173,6 @@ class ArithmeticCodingDecoder:
         lower_limit = 0
         upper_limit = whole
 
-        start_time = time.time()
-
         i = 1
         tag = 0
         while i <= self.precision and i <= len(bits):
@@ -140,29 +182,32 @@ class ArithmeticCodingDecoder:
 
         output = bytearray()
         total = self.total_freq
+        chars = self.unique_chars
+        intervals = [self.cum_freq[char] for char in chars]
+        cum_lows = [sym_low for sym_low, _ in intervals]
         n = 0
 
         while True:
             range_ = upper_limit - lower_limit
 
-            for char in self.unique_chars:
-                sym_low, sym_high = self.cum_freq[char]
-
-                upper_temp = lower_limit + (range_ * sym_high) // total
-                lower_temp = lower_limit + (range_ * sym_low) // total
-
-                if lower_temp <= tag < upper_temp:
-                    output.append(char)
-                    lower_limit = lower_temp
-                    upper_limit = upper_temp
-                    n += 1
-                    break  # move to next symbol
-            else:
+            # largest cumulative low whose scaled bound does not pass the tag
+            target = ((tag - lower_limit + 1) * total - 1) // range_
+            if not 0 <= target < total:
                 # No matching symbol found; input is malformed
                 raise ValueError("Failed to decode: No interval matched tag")
+            idx = bisect_right(cum_lows, target) - 1
+            sym_low, sym_high = intervals[idx]
+
+            output.append(chars[idx])
+            upper_limit = lower_limit + (range_ * sym_high) // total
+            lower_limit = lower_limit + (range_ * sym_low) // total
+            n += 1
 
             if n >= self.num_bytes:
                 break
+            if len(output) >= CHUNK_SIZE:
+                yield bytes(output)
+                output.clear()
             
             # rescaling
             while upper_limit < half or lower_limit > half: 
@@ -188,13 +233,7 @@ class ArithmeticCodingDecoder:
                         tag += 1 
                     i += 1
 
-        with open(self.output_path, 'wb') as f:
-            f.write(output)
-
-        end_time = time.time()
-
-        print(f"Time taken: {end_time - start_time:.4f} seconds")
-        print(f"Decompressed size: {len(output)} bytes")
+        yield bytes(output)
 
     def build_cumulative_freq_table(self):
         cum_freq = {}
@@ -206,31 +245,808 @@ class ArithmeticCodingDecoder:
         return cum_freq
 
     def read_file(self, file_path):
+        return self.parse(map_file(file_path))
+
+    def parse(self, raw):
         frequency_table = {}
-        with open(file_path, 'rb') as f:
-            num_symbols = int.from_bytes(f.read(2), 'big')
-            for _ in range(num_symbols):
-                byte = f.read(1)[0]  # single byte
-                freq = int.from_bytes(f.read(4), 'big')
-                frequency_table[byte] = freq
-            num_bytes = int.from_bytes(f.read(4), 'big')
-            data = f.read()
+        num_symbols = int.from_bytes(raw[:2], 'big')
+        pos = 2
+        for _ in range(num_symbols):
+            byte = raw[pos]  # single byte
+            freq = int.from_bytes(raw[pos + 1:pos + 5], 'big')
+            frequency_table[byte] = freq
+            pos += 5
+        num_bytes = int.from_bytes(raw[pos:pos + 4], 'big')
+        data = raw[pos + 4:]
         return frequency_table, num_bytes, data
     
 
+class RangeEncoder:
+    # 64-bit range coder, renormalizes a byte at a time and propagates
+    # carries through a cached byte plus a run of pending 0xFF bytes
+    STATE_BITS = 64
+    TOP = 1 << (STATE_BITS - 8)
+    MASK = (1 << STATE_BITS) - 1
+
+    def __init__(self):
+        self.low = 0
+        self.range = self.MASK
+        self.cache = 0
+        self.cache_size = 1
+        self.output = bytearray()
+
+    def encode(self, start, size, total):
+        r = self.range // total
+        self.low += start * r
+        self.range = size * r
+        while self.range < self.TOP:
+            self.range <<= 8
+            self.shift_low()
+
+    def shift_low(self):
+        low = self.low
+        if low < 0xFF << (self.STATE_BITS - 8) or low > self.MASK:
+            carry = low >> self.STATE_BITS
+            self.output.append((self.cache + carry) & 0xFF)
+            if self.cache_size > 1:
+                self.output += bytes([(0xFF + carry) & 0xFF]) * (self.cache_size - 1)
+            self.cache = (low >> (self.STATE_BITS - 8)) & 0xFF
+            self.cache_size = 0
+        self.cache_size += 1
+        self.low = (low << 8) & self.MASK
+
+    def finish(self):
+        for _ in range(self.STATE_BITS // 8 + 1):
+            self.shift_low()
+        return self.output
+
+
+class RangeDecoder:
+    STATE_BITS = RangeEncoder.STATE_BITS
+    TOP = RangeEncoder.TOP
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+        self.range = RangeEncoder.MASK
+        self.code = 0
+        # the first byte is the encoder's initial cache and is always 0
+        for _ in range(self.STATE_BITS // 8 + 1):
+            self.code = (self.code << 8) | self.next_byte()
+
+    def next_byte(self):
+        pos = self.pos
+        self.pos = pos + 1
+        return self.data[pos] if pos < len(self.data) else 0
+
+    def decode_freq(self, total):
+        self.range //= total
+        return min(self.code // self.range, total - 1)
+
+    def decode_update(self, start, size):
+        self.code -= start * self.range
+        self.range *= size
+        while self.range < self.TOP:
+            self.code = (self.code << 8) | self.next_byte()
+            self.range <<= 8
+
+
+class RangeCodingEncoder(ArithmeticCodingEncoder):
+    # same model and header as ArithmeticCodingEncoder, range-coded payload
+    STAGE = "arithmetic.range"
+
+    def encode_payload(self):
+        encoder = RangeEncoder()
+        total = self.total_freq
+        cum_freq = self.cum_freq
+        for byte in self.data:
+            sym_low, sym_high = cum_freq[byte]
+            encoder.encode(sym_low, sym_high - sym_low, total)
+        return encoder.finish()
+
+
+class RangeCodingDecoder(ArithmeticCodingDecoder):
+    STAGE = "arithmetic.range"
+
+    def decode_chunks(self):
+        decoder = RangeDecoder(self.data)
+        total = self.total_freq
+        chars = self.unique_chars
+        intervals = [self.cum_freq[char] for char in chars]
+        cum_lows = [sym_low for sym_low, _ in intervals]
+
+        output = bytearray()
+        for _ in range(self.num_bytes):
+            idx = bisect_right(cum_lows, decoder.decode_freq(total)) - 1
+            sym_low, sym_high = intervals[idx]
+            decoder.decode_update(sym_low, sym_high - sym_low)
+            output.append(chars[idx])
+            if len(output) >= CHUNK_SIZE:
+                yield bytes(output)
+                output.clear()
+
+        yield bytes(output)
+
+
+RANS_PROB_BITS = 15
+RANS_LOW = 1 << 16             # states stay in [RANS_LOW, RANS_LOW << 16), renormalized 16 bits at a time
+RANS_MAX_LANES = 1024
+RANS_SYMBOLS_PER_LANE = 2048   # every lane ends with a 4-byte state, keep that overhead small
+RANS_NUMPY_MIN_LANES = 64      # with fewer lanes per row the per-row numpy overhead dominates
+
+
+def rans_lanes(num_bytes):
+    lanes = 1
+    while lanes < RANS_MAX_LANES and lanes * 2 * RANS_SYMBOLS_PER_LANE <= num_bytes:
+        lanes *= 2
+    return lanes
+
+def normalize_frequencies(frequencies, prob_bits=RANS_PROB_BITS):
+    # scale the counts to sum to 2^prob_bits, every present symbol keeps at least 1;
+    # the rounding error goes to (or comes from) the largest symbols
+    total = sum(frequencies.values())
+    scale = 1 << prob_bits
+    norm = {symbol: max(1, freq * scale // total) for symbol, freq in sorted(frequencies.items())}
+    error = scale - sum(norm.values())
+    for symbol in sorted(norm, key=lambda s: (-norm[s], s)):
+        if error == 0:
+            break
+        delta = error if error > 0 else max(error, 1 - norm[symbol])
+        norm[symbol] += delta
+        error -= delta
+    cum = {}
+    start = 0
+    for symbol, freq in norm.items():
+        cum[symbol] = start
+        start += freq
+    return norm, cum
+
+def rans_encode(data, frequencies, tables=None):
+    # symbol i goes to lane i % lanes; lanes are coded together one row at a time,
+    # last row first, and the decoder replays the rows forwards.
+    # tables is a cached normalize_frequencies(frequencies) result
+    if not data:
+        return b''
+    lanes = rans_lanes(len(data))
+    norm, cum = tables or normalize_frequencies(frequencies)
+    if np is None or lanes < RANS_NUMPY_MIN_LANES:
+        states, rows = rans_encode_rows(data, norm, cum, lanes)
+        words = b''.join(word.to_bytes(2, 'big') for row in reversed(rows) for word in row)
+        return lanes.to_bytes(2, 'big') + b''.join(x.to_bytes(4, 'big') for x in states) + words
+
+    freq = np.zeros(256, dtype=np.uint64)
+    start = np.zeros(256, dtype=np.uint64)
+    for symbol in norm:
+        freq[symbol] = norm[symbol]
+        start[symbol] = cum[symbol]
+    limit = freq << np.uint64(32 - RANS_PROB_BITS)  # encoding would push the state past 2^32
+
+    symbols = np.frombuffer(data, dtype=np.uint8)
+    states = np.full(lanes, RANS_LOW, dtype=np.uint64)
+    rows = []
+    for row_start in range((len(symbols) - 1) // lanes * lanes, -1, -lanes):
+        row = symbols[row_start:row_start + lanes]
+        x = states[:len(row)]
+        f = freq[row]
+        spill = x >= limit[row]
+        if spill.any():
+            rows.append((x[spill] & np.uint64(0xffff)).astype(np.uint16))  # 16-bit words, not uint64
+            x[spill] >>= np.uint64(16)
+        q = x // f
+        x[:] = (q << np.uint64(RANS_PROB_BITS)) + (x - q * f) + start[row]
+
+    words = np.concatenate(rows[::-1]) if rows else np.empty(0, dtype=np.uint16)
+    del rows
+    if np.little_endian:
+        words.byteswap(inplace=True)  # the words are stored big-endian
+    return lanes.to_bytes(2, 'big') + states.astype('>u4').tobytes() + words.tobytes()
+
+def rans_encode_rows(data, norm, cum, lanes):
+    # pure-Python fallback, emits exactly what the numpy path does
+    states = [RANS_LOW] * lanes
+    rows = []
+    shift = 32 - RANS_PROB_BITS
+    for row_start in range((len(data) - 1) // lanes * lanes, -1, -lanes):
+        words = []
+        for lane, symbol in enumerate(data[row_start:row_start + lanes]):
+            x = states[lane]
+            f = norm[symbol]
+            if x >= f << shift:
+                words.append(x & 0xffff)
+                x >>= 16
+            states[lane] = ((x // f) << RANS_PROB_BITS) + x % f + cum[symbol]
+        rows.append(words)
+    return states, rows
+
+def rans_decode_chunks(payload, frequencies, num_bytes, tables=None):
+    # yields the output in pieces of about CHUNK_SIZE bytes
+    if num_bytes == 0:
+        return
+    lanes = int.from_bytes(payload[:2], 'big')
+    norm, cum = tables or normalize_frequencies(frequencies)
+    words_start = 2 + 4 * lanes
+    rows_per_chunk = max(1, CHUNK_SIZE // lanes)
+    # slot -> symbol lookup, one entry per unit of probability
+    table = bytearray()
+    for symbol, freq in norm.items():
+        table += bytes([symbol]) * freq
+
+    if np is None or lanes < RANS_NUMPY_MIN_LANES:
+        states = [int.from_bytes(payload[2 + 4 * i:6 + 4 * i], 'big') for i in range(lanes)]
+        pos = words_start
+        mask = (1 << RANS_PROB_BITS) - 1
+        output = bytearray()
+        for row_start in range(0, num_bytes, lanes):
+            for lane in range(min(lanes, num_bytes - row_start)):
+                x = states[lane]
+                slot = x & mask
+                symbol = table[slot]
+                x = norm[symbol] * (x >> RANS_PROB_BITS) + slot - cum[symbol]
+                if x < RANS_LOW:
+                    x = (x << 16) | int.from_bytes(payload[pos:pos + 2], 'big')
+                    pos += 2
+                states[lane] = x
+                output.append(symbol)
+            if len(output) >= CHUNK_SIZE:
+                yield bytes(output)
+                output.clear()
+        yield bytes(output)
+        return
+
+    freq = np.zeros(256, dtype=np.uint64)
+    start = np.zeros(256, dtype=np.uint64)
+    for symbol in norm:
+        freq[symbol] = norm[symbol]
+        start[symbol] = cum[symbol]
+    table = np.frombuffer(table, dtype=np.uint8)
+    mask = np.uint64((1 << RANS_PROB_BITS) - 1)
+
+    states = np.frombuffer(payload[2:words_start], dtype='>u4').astype(np.uint64)
+    words = np.frombuffer(payload[words_start:], dtype='>u2')  # widened one refill at a time
+    pos = 0
+    for chunk_start in range(0, num_bytes, rows_per_chunk * lanes):
+        chunk_end = min(num_bytes, chunk_start + rows_per_chunk * lanes)
+        output = np.empty(chunk_end - chunk_start, dtype=np.uint8)
+        for row_start in range(0, chunk_end - chunk_start, lanes):
+            row = output[row_start:row_start + lanes]
+            x = states[:len(row)]
+            slot = x & mask
+            row[:] = symbols = table[slot]
+            x[:] = freq[symbols] * (x >> np.uint64(RANS_PROB_BITS)) + slot - start[symbols]
+            refill = x < RANS_LOW
+            count = int(np.count_nonzero(refill))
+            if count:
+                x[refill] = (x[refill] << np.uint64(16)) | words[pos:pos + count].astype(np.uint64)
+                pos += count
+        yield output.tobytes()
+
+
+class RansCodingEncoder(ArithmeticCodingEncoder):
+    # same frequency header as ArithmeticCodingEncoder, interleaved rANS payload
+    STAGE = "arithmetic.rans"
+
+    def encode_payload(self):
+        return rans_encode(self.data, self.frequencies)
+
+
+class RansCodingDecoder(ArithmeticCodingDecoder):
+    STAGE = "arithmetic.rans"
+
+    def decode_chunks(self):
+        return rans_decode_chunks(self.data, self.frequencies, self.num_bytes)
+
+
+class ContextModel:
+    # PPM-style model: predict from the previous `order` bytes, escape to
+    # shorter contexts (method C escape counts, no exclusion) down to a
+    # flat order -1 model. Contexts live in a direct-mapped table of
+    # 2**table_bits slots, a colliding context evicts the old one. A slot
+    # keeps at most MAX_SYMBOLS symbols (a bytearray) and their counts (an
+    # array), about 450 bytes, so the default 2**16 slots stay under 30 MB.
+    MAX_TOTAL = 1 << 16
+    MAX_SYMBOLS = 32  # a new symbol in a full context replaces its least used one
+
+    def __init__(self, order=2, table_bits=16):
+        if not 0 <= order <= 3:
+            raise ValueError("Context order must be between 0 and 3")
+        if not 1 <= table_bits <= 24:
+            raise ValueError("Context table bits must be between 1 and 24")
+        self.order = order
+        self.table_bits = table_bits
+        self.slots = [None] * (1 << table_bits)
+        self.order0 = [0, bytearray(), array('I'), 0]
+        self.history = 0
+
+    def contexts(self):
+        # (slot index, key, stats or None) from the highest order down to order 1
+        found = []
+        history = self.history
+        shift = 32 - self.table_bits
+        for k in range(self.order, 0, -1):
+            key = ((history & ((1 << (8 * k)) - 1)) << 2) | k
+            index = ((key * 0x9E3779B1) & 0xFFFFFFFF) >> shift
+            stats = self.slots[index]
+            found.append((index, key, stats if stats is not None and stats[0] == key else None))
+        return found
+
+    def encode(self, encoder, symbol):
+        found = self.contexts()
+        for stats in [entry[2] for entry in found] + [self.order0]:
+            if stats is None or not stats[1]:
+                continue
+            symbols, counts, total = stats[1], stats[2], stats[3]
+            escape = len(symbols)
+            i = symbols.find(symbol)
+            if i >= 0:
+                encoder.encode(sum(counts[:i]), counts[i], total + escape)
+                break
+            encoder.encode(total, escape, total + escape)
+        else:
+            encoder.encode(symbol, 1, 256)
+        self.update(found, symbol)
+
+    def decode(self, decoder):
+        found = self.contexts()
+        for stats in [entry[2] for entry in found] + [self.order0]:
+            if stats is None or not stats[1]:
+                continue
+            symbols, counts, total = stats[1], stats[2], stats[3]
+            escape = len(symbols)
+            target = decoder.decode_freq(total + escape)
+            if target >= total:
+                decoder.decode_update(total, escape)
+                continue
+            start = 0
+            for i, count in enumerate(counts):
+                if target < start + count:
+                    break
+                start += count
+            decoder.decode_update(start, count)
+            symbol = symbols[i]
+            break
+        else:
+            symbol = decoder.decode_freq(256)
+            decoder.decode_update(symbol, 1)
+        self.update(found, symbol)
+        return symbol
+
+    def update(self, found, symbol):
+        for index, key, stats in found:
+            if stats is None:
+                stats = self.slots[index] = [key, bytearray(), array('I'), 0]
+            self.bump(stats, symbol, self.MAX_SYMBOLS)
+        self.bump(self.order0, symbol, 256)
+        self.history = ((self.history << 8) | symbol) & 0xFFFFFF
+
+    def bump(self, stats, symbol, max_symbols):
+        symbols, counts = stats[1], stats[2]
+        i = symbols.find(symbol)
+        if i >= 0:
+            counts[i] += 1
+        else:
+            if len(symbols) >= max_symbols:
+                j = counts.index(min(counts))
+                stats[3] -= counts[j]
+                del symbols[j]
+                del counts[j]
+            symbols.append(symbol)
+            counts.append(1)
+        stats[3] += 1
+        if stats[3] > self.MAX_TOTAL:
+            for i in range(len(counts)):
+                counts[i] = (counts[i] + 1) >> 1
+            stats[3] = sum(counts)
+
+
+def context_encode(data, order=2, table_bits=16):
+    model = ContextModel(order, table_bits)
+    encoder = RangeEncoder()
+    for byte in data:
+        model.encode(encoder, byte)
+    return bytes(encoder.finish())
+
+def context_decode(payload, num_bytes, order=2, table_bits=16):
+    model = ContextModel(order, table_bits)
+    decoder = RangeDecoder(payload)
+    return bytes(model.decode(decoder) for _ in range(num_bytes))
+
+
+class ContextCodingEncoder:
+    def __init__(self, input_path, output_path, order=2, table_bits=16, data=None):
+        self.start_time = time.time()
+        self.input_path = input_path
+        self.output_path = output_path
+        self.data = map_file(input_path) if data is None else data
+        self.num_bytes = len(self.data)
+        self.order = order
+        self.table_bits = table_bits
+
+    def encode(self):
+        start_time = self.start_time
+        compressed_size = write_chunks(self.output_path, [self.header_bytes(), self.encode_payload()])
+
+        end_time = time.time()
+        original_size = self.num_bytes
+
+        compression_ratio = original_size / compressed_size if compressed_size != 0 else 0
+
+        print(f"Compressed '{self.input_path}' : '{self.output_path}'")
+        print(f"Time taken: {end_time - start_time:.4f} seconds")
+        print(f"Original size: {original_size} bytes")
+        print(f"Compressed size: {compressed_size} bytes")
+        print(f"diff in size: {original_size - compressed_size} bytes")
+        print(f"Compression ratio: {compression_ratio:.2f}")
+
+    def header_bytes(self):
+        # the decoder rebuilds the same model from these, nothing has to be passed again
+        return self.num_bytes.to_bytes(8, 'big') + bytes([self.order, self.table_bits])
+
+    def encode_payload(self):
+        with stage("arithmetic.ppm.encode"):
+            payload = context_encode(self.data, self.order, self.table_bits)
+        count("arithmetic.ppm.symbols", self.num_bytes)
+        return payload
+
+    def encode_bytes(self):
+        return self.header_bytes() + self.encode_payload()
+
+
+class ContextCodingDecoder:
+    def __init__(self, input_path, output_path, raw=None):
+        self.start_time = time.time()
+        if raw is None:
+            raw = map_file(input_path)
+        if len(raw) < 10:
+            raise ValueError("Truncated PPM header")
+        self.num_bytes = int.from_bytes(raw[:8], 'big')
+        self.order = raw[8]
+        self.table_bits = raw[9]
+        self.data = raw[10:]
+        self.output_path = output_path
+
+    def decode(self):
+        start_time = self.start_time
+        decompressed_size = write_chunks(self.output_path, self.decode_chunks())
+
+        end_time = time.time()
+
+        print(f"Time taken: {end_time - start_time:.4f} seconds")
+        print(f"Decompressed size: {decompressed_size} bytes")
+
+    def decode_bytes(self):
+        with stage("arithmetic.ppm.decode"):
+            return context_decode(self.data, self.num_bytes, self.order, self.table_bits)
+
+    def decode_chunks(self):
+        yield self.decode_bytes()
+
+
+class FenwickTree:
+    def __init__(self, size, initial=1):
+        self.size = size
+        self.freqs = [initial] * size
+        self.rebuild()
+
+    def rebuild(self):
+        tree = [0] * (self.size + 1)
+        for i, freq in enumerate(self.freqs, 1):
+            tree[i] += freq
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.total = sum(self.freqs)
+
+    def add(self, index, delta):
+        self.freqs[index] += delta
+        self.total += delta
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, index):
+        # sum of freqs[0:index]
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def find(self, target):
+        # index whose cumulative interval [low, low + freq) contains target
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return pos
+
+
+class AdaptiveModel:
+    EOF_SYMBOL = 256
+
+    def __init__(self, max_total, increment=32):
+        self.tree = FenwickTree(257)
+        self.max_total = max_total
+        self.increment = increment
+
+    def interval(self, symbol):
+        low = self.tree.prefix_sum(symbol)
+        return low, low + self.tree.freqs[symbol]
+
+    def find(self, target):
+        symbol = self.tree.find(target)
+        low = self.tree.prefix_sum(symbol)
+        return symbol, low, low + self.tree.freqs[symbol]
+
+    def update(self, symbol):
+        self.tree.add(symbol, self.increment)
+        if self.tree.total > self.max_total:
+            # halve every count, keeping each symbol codable
+            self.tree.freqs = [(freq + 1) >> 1 for freq in self.tree.freqs]
+            self.tree.rebuild()
+
+
+class AdaptiveArithmeticEncoder:
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, input_path, output_path, precision=16):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.precision = precision
+
+    def encode(self):
+        start_time = time.time()
+        infile = sys.stdin.buffer if self.input_path == '-' else open(self.input_path, 'rb')
+        outfile = sys.stdout.buffer if self.output_path == '-' else open(self.output_path, 'wb')
+        try:
+            with stage("arithmetic.adaptive.encode"):
+                num_bytes, written = self.encode_stream(infile, outfile)
+            count("arithmetic.adaptive.symbols", num_bytes)
+        finally:
+            if infile is not sys.stdin.buffer:
+                infile.close()
+            if outfile is not sys.stdout.buffer:
+                outfile.close()
+            else:
+                outfile.flush()
+
+        end_time = time.time()
+        compression_ratio = num_bytes / written if written != 0 else 0
+
+        # keep stdout clean for the compressed stream when writing to a pipe
+        log = sys.stderr if self.output_path == '-' else sys.stdout
+        print(f"Compressed '{self.input_path}' : '{self.output_path}'", file=log)
+        print(f"Time taken: {end_time - start_time:.4f} seconds", file=log)
+        print(f"Original size: {num_bytes} bytes", file=log)
+        print(f"Compressed size: {written} bytes", file=log)
+        print(f"diff in size: {num_bytes - written} bytes", file=log)
+        print(f"Compression ratio: {compression_ratio:.2f}", file=log)
+
+    def encode_stream(self, infile, outfile):
+        whole = 1 << self.precision
+        half = whole >> 1
+        quarter = whole >> 2
+
+        lower_limit = 0
+        upper_limit = whole
+        rem_bits = 0
+        num_bytes = 0
+        written = 0
+        # every interval must stay non-empty while the range is just above a quarter
+        model = AdaptiveModel(quarter)
+        bits = bitarray()
+
+        while True:
+            chunk = infile.read(self.CHUNK_SIZE)
+            symbols = list(chunk) if chunk else [AdaptiveModel.EOF_SYMBOL]
+            num_bytes += len(chunk)
+
+            for symbol in symbols:
+                range_ = upper_limit - lower_limit
+                sym_low, sym_high = model.interval(symbol)
+                total = model.tree.total
+                model.update(symbol)
+
+                upper_limit = lower_limit + (range_ * sym_high) // total
+                lower_limit = lower_limit + (range_ * sym_low) // total
+
+                # rescaling
+                while upper_limit < half or lower_limit > half:
+                    if lower_limit > half:
+                        bits.append(1)
+                        bits.extend([0] * rem_bits)
+                        lower_limit = (lower_limit - half) << 1
+                        upper_limit = (upper_limit - half) << 1
+                    else:
+                        bits.append(0)
+                        bits.extend([1] * rem_bits)
+                        lower_limit <<= 1
+                        upper_limit <<= 1
+                    rem_bits = 0
+
+                while upper_limit < 3*quarter and lower_limit > quarter:
+                    rem_bits += 1
+                    lower_limit = 2 * (lower_limit - quarter)
+                    upper_limit = 2 * (upper_limit - quarter)
+
+            # flush whole bytes so memory stays bounded
+            whole_bytes = len(bits) >> 3
+            if whole_bytes:
+                outfile.write(bits[:whole_bytes << 3].tobytes())
+                del bits[:whole_bytes << 3]
+                written += whole_bytes
+
+            if not chunk:
+                break
+
+        rem_bits += 1
+        if lower_limit <= quarter:
+            bits.append(0)
+            bits.extend([1] * rem_bits)
+        else:
+            bits.append(1)
+            bits.extend([0] * rem_bits)
+        tail = bits.tobytes()
+        outfile.write(tail)
+        return num_bytes, written + len(tail)
+
+
+class AdaptiveArithmeticDecoder:
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, input_path, output_path, precision=16):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.precision = precision
+
+    def decode(self):
+        start_time = time.time()
+        infile = sys.stdin.buffer if self.input_path == '-' else open(self.input_path, 'rb')
+        outfile = sys.stdout.buffer if self.output_path == '-' else open(self.output_path, 'wb')
+        try:
+            with stage("arithmetic.adaptive.decode"):
+                written = self.decode_stream(infile, outfile)
+        finally:
+            if infile is not sys.stdin.buffer:
+                infile.close()
+            if outfile is not sys.stdout.buffer:
+                outfile.close()
+            else:
+                outfile.flush()
+
+        end_time = time.time()
+
+        log = sys.stderr if self.output_path == '-' else sys.stdout
+        print(f"Time taken: {end_time - start_time:.4f} seconds", file=log)
+        print(f"Decompressed size: {written} bytes", file=log)
+
+    def decode_stream(self, infile, outfile):
+        whole = 1 << self.precision
+        half = whole >> 1
+        quarter = whole >> 2
+
+        lower_limit = 0
+        upper_limit = whole
+        model = AdaptiveModel(quarter)
+
+        bits = bitarray()
+        i = 0
+
+        def next_bit():
+            # bits past the end of the stream read as 0
+            nonlocal bits, i
+            if i >= len(bits):
+                chunk = infile.read(self.CHUNK_SIZE)
+                if not chunk:
+                    return 0
+                bits = bitarray()
+                bits.frombytes(chunk)
+                i = 0
+            i += 1
+            return bits[i - 1]
+
+        output = bytearray()
+        written = 0
+        tag = 0
+        for _ in range(self.precision):
+            tag = (tag << 1) | next_bit()
+
+        while True:
+            range_ = upper_limit - lower_limit
+            total = model.tree.total
+
+            target = ((tag - lower_limit + 1) * total - 1) // range_
+            if not 0 <= target < total:
+                raise ValueError("Failed to decode: No interval matched tag")
+            symbol, sym_low, sym_high = model.find(target)
+            if symbol == AdaptiveModel.EOF_SYMBOL:
+                break
+            model.update(symbol)
+            output.append(symbol)
+            if len(output) >= self.CHUNK_SIZE:
+                outfile.write(output)
+                written += len(output)
+                output = bytearray()
+
+            upper_limit = lower_limit + (range_ * sym_high) // total
+            lower_limit = lower_limit + (range_ * sym_low) // total
+
+            # rescaling
+            while upper_limit < half or lower_limit > half:
+                if lower_limit > half:
+                    lower_limit = (lower_limit - half) << 1
+                    upper_limit = (upper_limit - half) << 1
+                    tag = (tag - half) << 1
+                else:
+                    lower_limit <<= 1
+                    upper_limit <<= 1
+                    tag <<= 1
+                tag |= next_bit()
+
+            while upper_limit < 3*quarter and lower_limit > quarter:
+                lower_limit = 2 * (lower_limit - quarter)
+                upper_limit = 2 * (upper_limit - quarter)
+                tag = (2 * (tag - quarter)) | next_bit()
+
+        outfile.write(output)
+        return written + len(output)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Arithmetic Coding Compression Tool")
     parser.add_argument("mode", choices=["compress", "decompress"], help="Mode of operation")
-    parser.add_argument("input", help="Input file path")
-    parser.add_argument("output", help="Output file path (optional)")
+    parser.add_argument("input", help="Input file path ('-' for stdin with --adaptive)")
+    parser.add_argument("output", help="Output file path ('-' for stdout with --adaptive)")
     parser.add_argument("--precision", type=int, default=16, help="Compression precision (default: 16)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Single-pass adaptive model, no frequency header (must match on decompress)")
+    parser.add_argument("--engine", choices=["bit", "range", "rans"], default="bit",
+                        help="Coding engine for the static model: bit-level coder, 64-bit range coder "
+                             "or interleaved rANS (default: bit)")
+    parser.add_argument("--order", type=int, default=None, choices=[0, 1, 2, 3],
+                        help="Use an order-N PPM context model on the range engine (on decompress any N "
+                             "selects the PPM decoder, the order is read from the file)")
+    parser.add_argument("--table-bits", type=int, default=16,
+                        help="log2 of the context table size for --order (default: 16, stored in the file)")
+    instrument.add_arguments(parser)
 
     args = parser.parse_args()
+    instrument.configure(args)
+    if args.adaptive and args.engine != "bit":
+        parser.error("--adaptive only supports the bit engine")
+    if args.order is not None and args.adaptive:
+        parser.error("--order and --adaptive are mutually exclusive")
 
-    if args.mode == "compress":
-        encoder = ArithmeticCodingEncoder(args.input, args.output, args.precision)
+    if args.order is not None:
+        if args.mode == "compress":
+            ContextCodingEncoder(args.input, args.output, args.order, args.table_bits).encode()
+        else:
+            ContextCodingDecoder(args.input, args.output).decode()
+    elif args.mode == "compress":
+        if args.adaptive:
+            encoder_cls = AdaptiveArithmeticEncoder
+        elif args.engine == "range":
+            encoder_cls = RangeCodingEncoder
+        elif args.engine == "rans":
+            encoder_cls = RansCodingEncoder
+        else:
+            encoder_cls = ArithmeticCodingEncoder
+        encoder = encoder_cls(args.input, args.output, args.precision)
         encoder.encode()
     else:
-        decoder = ArithmeticCodingDecoder(args.input, args.output, args.precision)
+        if args.adaptive:
+            decoder_cls = AdaptiveArithmeticDecoder
+        elif args.engine == "range":
+            decoder_cls = RangeCodingDecoder
+        elif args.engine == "rans":
+            decoder_cls = RansCodingDecoder
+        else:
+            decoder_cls = ArithmeticCodingDecoder
+        decoder = decoder_cls(args.input, args.output, args.precision)
         decoder.decode()
 
@@ -0,0 +1,117 @@
+import heapq
+import io
+import math
+from collections import Counter
+
+from arithmetic import rans_lanes
+from lzw import LZWCompressor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SAMPLE_SLICES = 4              # evenly spaced slices given to the trial LZW run
+SAMPLE_SLICE = 1 << 12
+MIN_SAMPLE_SLICE = 1 << 10     # blocks up to this size are tried whole; samples split no finer than this
+TRIAL_FRACTION = 8             # the trial never codes more than this share of the block
+HISTOGRAM_SAMPLES = 64         # slices counted when numpy is missing
+HISTOGRAM_SLICE = 1 << 10
+LZW_SAMPLE_SCALE = 0.88        # LZW on a full block beats its small-sample ratio by roughly this much
+DEFAULT_SPEED_WEIGHT = 0.02
+MISPREDICT_MARGIN = 0.25       # output this much over its estimate makes auto try the next codec
+
+# compress + decompress seconds per MB measured with eval.py, only their relative sizes matter
+SECONDS_PER_MB = {
+    "stored": 0.001,
+    "huffman": 0.25,
+    "rans": 0.2,
+    "lzw": 0.9,
+    "range": 2.7,
+}
+# fixed per-block header bytes each codec adds on top of its payload
+HEADER_BYTES = {
+    "stored": 0,
+    "huffman": 4 + 1 + 2,
+    "lzw": 5,
+    "range": 2 + 4,
+    "rans": 2 + 4 + 2,
+}
+
+
+def byte_histogram(data):
+    # returns (counts, sampled_bytes); without numpy only evenly spaced slices are counted
+    n = len(data)
+    if np is not None:
+        return np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256).tolist(), n
+    if n <= HISTOGRAM_SAMPLES * HISTOGRAM_SLICE:
+        counts = Counter(data)
+    else:
+        step = n // HISTOGRAM_SAMPLES
+        counts = Counter()
+        for start in range(0, step * HISTOGRAM_SAMPLES, step):
+            counts.update(data[start:start + HISTOGRAM_SLICE])
+    return [counts.get(i, 0) for i in range(256)], sum(counts.values())
+
+def entropy(counts, total):
+    # order-0 entropy in bits per byte
+    return -sum(c / total * math.log2(c / total) for c in counts if c)
+
+def huffman_bits(counts, total):
+    # average Huffman code length for this histogram, exact when the whole block was counted:
+    # every merge adds one bit to each symbol below it, so the coded size is the sum of the merges
+    heap = [c for c in counts if c]
+    if len(heap) == 1:
+        return 1.0  # a lone symbol still needs one bit
+    heapq.heapify(heap)
+    coded = 0
+    while len(heap) > 1:
+        merged = heapq.heappop(heap) + heapq.heappop(heap)
+        coded += merged
+        heapq.heappush(heap, merged)
+    return coded / total
+
+def lzw_bits(data, max_bits=16):
+    # trial LZW run on slices spread over the block, so mixed blocks are sampled fairly;
+    # at most 1/TRIAL_FRACTION of the block, so small blocks are not coded twice
+    n = len(data)
+    if n <= MIN_SAMPLE_SLICE:
+        sample, scale = data, 1.0
+    else:
+        sample_size = min(SAMPLE_SLICES * SAMPLE_SLICE, n // TRIAL_FRACTION)
+        slices = max(1, min(SAMPLE_SLICES, sample_size // MIN_SAMPLE_SLICE))
+        slice_size = sample_size // slices
+        step = n // slices
+        sample = b''.join(data[start:start + slice_size] for start in range(step // 2, n, step)[:slices])
+        scale = LZW_SAMPLE_SCALE
+    out = io.BytesIO()
+    LZWCompressor(max_bits).compress_stream(io.BytesIO(sample), out)
+    return (out.tell() - HEADER_BYTES["lzw"]) * 8 / len(sample) * scale
+
+def estimate_sizes(data):
+    # predicted compressed size in bytes for each candidate codec
+    n = len(data)
+    if n == 0:
+        return {name: HEADER_BYTES[name] for name in SECONDS_PER_MB}
+    counts, total = byte_histogram(data)
+    used = [symbol for symbol, c in enumerate(counts) if c]
+    return {
+        "stored": n,
+        "huffman": n * huffman_bits(counts, total) / 8 + HEADER_BYTES["huffman"] + used[-1] - used[0] + 1,
+        "lzw": n * lzw_bits(data) / 8 + HEADER_BYTES["lzw"],
+        "range": n * entropy(counts, total) / 8 + HEADER_BYTES["range"] + 5 * len(used),
+        "rans": n * entropy(counts, total) / 8 + HEADER_BYTES["rans"] + 5 * len(used) + 4 * rans_lanes(n),
+    }
+
+def rank_codecs(data, speed_weight=DEFAULT_SPEED_WEIGHT, candidates=None):
+    # (name, predicted size) cheapest first; cost is predicted size per input byte plus
+    # speed_weight per second/MB of coding time, so 0 ranks by size alone and 0.02 only
+    # pays for a slower codec when it saves more than 2% of the block per extra second/MB
+    sizes = estimate_sizes(data)
+    names = candidates or list(sizes)
+    n = max(len(data), 1)
+    names = sorted(names, key=lambda name: (sizes[name] / n + speed_weight * SECONDS_PER_MB[name], name))
+    return [(name, sizes[name]) for name in names]
+
+def choose_codec(data, speed_weight=DEFAULT_SPEED_WEIGHT, candidates=None):
+    return rank_codecs(data, speed_weight, candidates)[0][0]
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import api
+import autoselect
+import container
+import instrument
+from fileio import map_file, write_chunks
+from instrument import count, stage
+
+SUFFIX = ".hac"
+JOURNAL_NAME = ".batch-journal"
+SMALL_FILE_SIZE = 1 << 18        # files below this are grouped into one task
+BATCH_BYTES = 1 << 22            # ...until a group holds this many bytes
+BATCH_FILES = 256                # ...or this many files
+DEFAULT_MAX_IN_FLIGHT = 1 << 28  # input bytes handed to the pool at once
+
+
+def find_files(source):
+    # (relative path, size, mtime_ns) for a directory tree, or for the files
+    # listed one per line in a manifest (relative to the manifest's directory)
+    if os.path.isdir(source):
+        root = source
+        paths = []
+        for dirpath, _, filenames in os.walk(source):
+            for filename in filenames:
+                if filename == JOURNAL_NAME or filename.endswith(".part"):
+                    continue  # left behind by an earlier batch run
+                paths.append(os.path.relpath(os.path.join(dirpath, filename), root))
+    else:
+        root = os.path.dirname(source)
+        with open(source) as f:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    files = []
+    for path in paths:
+        stat = os.stat(os.path.join(root, path))
+        files.append((path, stat.st_size, stat.st_mtime_ns))
+    return root, files
+
+def plan_tasks(files, workers=None):
+    # largest files first so a big one never starts last and leaves the other
+    # workers idle; small files are grouped so each task pays IPC once, but
+    # split at least workers ways so a tree of small files still fills the pool
+    workers = workers or os.cpu_count() or 1
+    small_bytes = sum(size for _, size, _ in files if size < SMALL_FILE_SIZE)
+    group_limit = max(1, min(BATCH_BYTES, -(-small_bytes // workers)))
+    tasks = []
+    group = []
+    group_bytes = 0
+    for entry in sorted(files, key=lambda entry: (-entry[1], entry[0])):
+        if entry[1] >= SMALL_FILE_SIZE:
+            tasks.append([entry])
+            continue
+        group.append(entry)
+        group_bytes += entry[1]
+        if group_bytes >= group_limit or len(group) >= BATCH_FILES:
+            tasks.append(group)
+            group = []
+            group_bytes = 0
+    if group:
+        tasks.append(group)
+    return tasks
+
+
+def compress_file(src_path, dst_path, codec, block_size):
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        return container.compress_stream(src, dst, codec, block_size)[1]
+
+def decompress_file(src_path, dst_path, codec, block_size):
+    reader = container.ContainerReader(map_file(src_path))
+    return write_chunks(dst_path, reader.iter_blocks())
+
+def output_path(out_dir, path, mode):
+    if mode == "compress":
+        return os.path.join(out_dir, path + SUFFIX)
+    return os.path.join(out_dir, path[:-len(SUFFIX)] if path.endswith(SUFFIX) else path + ".out")
+
+def run_task(mode, root, out_dir, entries, codec, block_size, speed_weight):
+    # runs in a worker; returns one (path, size, mtime_ns, output_size, error) per file
+    api.get_codec("auto").speed_weight = speed_weight
+    run = compress_file if mode == "compress" else decompress_file
+    results = []
+    for path, size, mtime_ns in entries:
+        dst_path = output_path(out_dir, path, mode)
+        tmp_path = dst_path + ".part"
+        try:
+            os.makedirs(os.path.dirname(dst_path) or ".", exist_ok=True)
+            output_size = run(os.path.join(root, path), tmp_path, codec, block_size)
+            # renamed only once complete, so an interrupted run never leaves a truncated output
+            os.replace(tmp_path, dst_path)
+            results.append((path, size, mtime_ns, output_size, None))
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            results.append((path, size, mtime_ns, 0, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def load_journal(journal_path):
+    # path -> (size, mtime_ns, output_size) of every file finished by an earlier run;
+    # a torn last line from an interrupted run is ignored
+    done = {}
+    if os.path.exists(journal_path):
+        with open(journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                done[entry["path"]] = (entry["size"], entry["mtime_ns"], entry["output_size"])
+    return done
+
+def run_batch(source, out_dir, mode="compress", codec="huffman", workers=None, block_size=container.DEFAULT_BLOCK_SIZE,
+              max_in_flight=DEFAULT_MAX_IN_FLIGHT, resume=True, speed_weight=autoselect.DEFAULT_SPEED_WEIGHT):
+    start_time = time.time()
+    root, files = find_files(source)
+    os.makedirs(out_dir, exist_ok=True)
+    journal_path = os.path.join(out_dir, JOURNAL_NAME)
+    done = load_journal(journal_path) if resume else {}
+
+    # a file is skipped only if it is unchanged since it was journaled and its output is still there
+    pending = []
+    skipped = 0
+    for path, size, mtime_ns in files:
+        entry = done.get(path)
+        if entry is not None and entry[:2] == (size, mtime_ns) and os.path.exists(output_path(out_dir, path, mode)):
+            skipped += 1
+        else:
+            pending.append((path, size, mtime_ns))
+    tasks = plan_tasks(pending, workers)
+
+    stats = {"files": 0, "skipped": skipped, "failed": [], "input_bytes": 0, "output_bytes": 0}
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        with open(journal_path, 'a' if resume else 'w') as journal:
+            running = {}
+            in_flight = 0
+            next_task = 0
+            while next_task < len(tasks) or running:
+                # keep submitting until the byte cap is reached; one task always runs even if it is larger
+                while next_task < len(tasks):
+                    task_bytes = sum(size for _, size, _ in tasks[next_task])
+                    if running and in_flight + task_bytes > max_in_flight:
+                        break
+                    future = pool.submit(instrument.worker(run_task), mode, root, out_dir, tasks[next_task], codec, block_size, speed_weight)
+                    running[future] = task_bytes
+                    in_flight += task_bytes
+                    next_task += 1
+                    count("batch.tasks")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    in_flight -= running.pop(future)
+                    with stage("batch.journal"):
+                        for path, size, mtime_ns, output_size, error in instrument.merged(future.result()):
+                            if error is not None:
+                                stats["failed"].append((path, error))
+                                print(f"FAILED {path}: {error}")
+                                continue
+                            stats["files"] += 1
+                            stats["input_bytes"] += size if mode == "compress" else output_size
+                            stats["output_bytes"] += output_size if mode == "compress" else size
+                            journal.write(json.dumps({"path": path, "size": size, "mtime_ns": mtime_ns,
+                                                      "output_size": output_size}) + "\n")
+                        journal.flush()
+    except KeyboardInterrupt:
+        # drop the queued tasks instead of waiting for them; everything journaled so far is kept
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+
+    stats["seconds"] = time.time() - start_time
+    count("batch.files", stats["files"])
+    count("batch.skipped", skipped)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress or decompress a whole directory tree in parallel")
+    parser.add_argument("mode", choices=["compress", "decompress"], help="Mode of operation")
+    parser.add_argument("source", help="Input directory, or a manifest listing one file per line")
+    parser.add_argument("output", help="Output directory, the input tree is mirrored into it")
+    parser.add_argument("--codec", default="huffman", help="Codec name, see 'api.py list' (default: huffman)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--block-size", type=int, default=container.DEFAULT_BLOCK_SIZE,
+                        help=f"Container block size in bytes (default: {container.DEFAULT_BLOCK_SIZE})")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help=f"Input bytes queued to the workers at once (default: {DEFAULT_MAX_IN_FLIGHT})")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Redo every file instead of skipping those in the output's journal")
+    parser.add_argument("--speed-weight", type=float, default=autoselect.DEFAULT_SPEED_WEIGHT,
+                        help="auto codec only: 0 picks the smallest output, larger values favour faster codecs "
+                             f"(default: {autoselect.DEFAULT_SPEED_WEIGHT})")
+    instrument.add_arguments(parser)
+
+    args = parser.parse_args()
+    instrument.configure(args)
+    api.get_codec(args.codec)  # fail on a bad name before starting the pool
+
+    try:
+        stats = run_batch(args.source, args.output, args.mode, args.codec, args.workers, args.block_size,
+                          args.max_in_flight, not args.no_resume, args.speed_weight)
+    except KeyboardInterrupt:
+        print("Interrupted, run the same command again to resume")
+        sys.exit(130)
+    mb = stats["input_bytes"] / (1024 * 1024)
+    print(f"{args.mode.capitalize()}ed {stats['files']} files into '{args.output}' "
+          f"({stats['skipped']} already done, {len(stats['failed'])} failed)")
+    print(f"Time taken: {stats['seconds']:.4f} seconds")
+    print(f"Original size: {stats['input_bytes']} bytes")
+    print(f"Compressed size: {stats['output_bytes']} bytes")
+    if stats["output_bytes"]:
+        print(f"Compression ratio: {stats['input_bytes'] / stats['output_bytes']:.2f}")
+    print(f"Throughput: {mb / stats['seconds'] if stats['seconds'] > 0 else 0:.3f} MB/s")
+    if stats["failed"]:
+        sys.exit(1)
@@ -0,0 +1,96 @@
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from arithmetic import context_encode, context_decode
+from lzw import LZWCompressor
+
+
+def measure(func, *args, repeat=3):
+    # run func `repeat` times, return its last result and the median wall time
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return result, statistics.median(timings)
+
+def mb_per_s(num_bytes, seconds):
+    return num_bytes / (1024 * 1024) / seconds if seconds > 0 else 0
+
+def bench_context_orders(data, orders=(0, 1, 2, 3), table_bits=16, repeat=3):
+    rows = []
+    for order in orders:
+        payload, comp_time = measure(context_encode, data, order, table_bits, repeat=repeat)
+        decoded, decomp_time = measure(context_decode, payload, len(data), order, table_bits, repeat=repeat)
+        if decoded != data:
+            raise ValueError(f"Order {order} round trip failed")
+        rows.append({
+            "order": order,
+            "compressed_size": len(payload),
+            "ratio": len(data) / len(payload) if payload else 0,
+            "compress_mb_s": mb_per_s(len(data), comp_time),
+            "decompress_mb_s": mb_per_s(len(data), decomp_time),
+        })
+    return rows
+
+def print_context_rows(name, size, rows):
+    print(f"{name} ({size} bytes)")
+    print(f"{'order':>5} {'size':>10} {'ratio':>7} {'comp MB/s':>10} {'decomp MB/s':>12}")
+    for row in rows:
+        print(f"{row['order']:>5} {row['compressed_size']:>10} {row['ratio']:>7.2f} "
+              f"{row['compress_mb_s']:>10.3f} {row['decompress_mb_s']:>12.3f}")
+
+def bench_lzw(path, max_bits=16, repeat=3):
+    lzw = LZWCompressor(max_bits)
+    size = os.path.getsize(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        compressed = os.path.join(tmp, "out.lzw")
+        decompressed = os.path.join(tmp, "out.bin")
+        # the codec prints its own stats, keep them out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, comp_time = measure(lzw.lzw_compress, path, compressed, repeat=repeat)
+            _, decomp_time = measure(lzw.lzw_decompress, compressed, decompressed, repeat=repeat)
+        if Path(decompressed).read_bytes() != Path(path).read_bytes():
+            raise ValueError(f"LZW round trip failed for {path}")
+        return {
+            "compressed_size": os.path.getsize(compressed),
+            "ratio": size / os.path.getsize(compressed),
+            "compress_mb_s": mb_per_s(size, comp_time),
+            "decompress_mb_s": mb_per_s(size, decomp_time),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compression micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    context_parser = subparsers.add_parser("context", help="Ratio and throughput of the arithmetic context model per order")
+    context_parser.add_argument("inputs", nargs="+", help="Input files")
+    context_parser.add_argument("--orders", type=int, nargs="+", default=[0, 1, 2, 3], help="Orders to compare (default: 0 1 2 3)")
+    context_parser.add_argument("--table-bits", type=int, default=16, help="log2 of the context table size (default: 16)")
+    context_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the median is reported (default: 3)")
+
+    lzw_parser = subparsers.add_parser("lzw", help="LZW compress/decompress throughput")
+    lzw_parser.add_argument("inputs", nargs="+", help="Input files")
+    lzw_parser.add_argument("--max-bits", type=int, default=16, help="Maximum code width in bits (default: 16)")
+    lzw_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the median is reported (default: 3)")
+
+    args = parser.parse_args()
+
+    if args.bench == "context":
+        for path in args.inputs:
+            data = Path(path).read_bytes()
+            rows = bench_context_orders(data, args.orders, args.table_bits, args.repeat)
+            print_context_rows(path, len(data), rows)
+    elif args.bench == "lzw":
+        print(f"{'file':<40} {'size':>10} {'ratio':>7} {'comp MB/s':>10} {'decomp MB/s':>12}")
+        for path in args.inputs:
+            row = bench_lzw(path, args.max_bits, args.repeat)
+            print(f"{path:<40} {row['compressed_size']:>10} {row['ratio']:>7.2f} "
+                  f"{row['compress_mb_s']:>10.3f} {row['decompress_mb_s']:>12.3f}")
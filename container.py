@@ -0,0 +1,462 @@
+import argparse
+import bisect
+import json
+import sys
+import time
+import zlib
+
+import api
+import autoselect
+import instrument
+import models
+from instrument import count, stage
+from fileio import map_file, write_chunks
+
+# file layout:
+#   header   magic, version, default codec id, block size
+#   blocks   codec id (picked per block in auto mode), raw size, stored size, CRC32 of the raw bytes, payload
+#   index    file offset and raw size of every block
+#   footer   index offset, block count, footer magic
+# append() adds a segment after the old footer: its blocks, an index of just those
+# blocks, and a segment footer that also points at the end of the previous footer.
+# The reader follows that chain back to the first footer, and the file ends in a
+# valid footer before and after every append.
+# With a reuse model backend, the first segment is followed by a model record (raw
+# size 0, payload a models.py model trained on that segment) and later segments'
+# blocks are coded against it, so small appends carry no tables of their own; a
+# new record is only stored when the old model stops paying off
+FORMAT_MAGIC = b'HAC'
+FORMAT_VERSION = 1
+FOOTER_MAGIC = b'HACX'
+SEGMENT_MAGIC = b'HACS'
+DEFAULT_BLOCK_SIZE = 1 << 20
+HEADER_SIZE = 3 + 1 + 1 + 4
+BLOCK_HEADER_SIZE = 1 + 4 + 4 + 4
+INDEX_ENTRY_SIZE = 8 + 4
+FOOTER_SIZE = 8 + 4 + 4
+SEGMENT_FOOTER_SIZE = 8 + 4 + 8 + 4
+MODEL_CODED_ID = 254   # block coded by models.py against a model record
+MODEL_RECORD_ID = 255
+MODEL_SAMPLE = 1 << 20  # trailing bytes of a segment the next segment's model is trained on
+
+
+def encode_header(codec_id, block_size):
+    return FORMAT_MAGIC + bytes([FORMAT_VERSION, codec_id]) + block_size.to_bytes(4, 'big')
+
+def encode_block_header(block_id, raw_size, stored_size, crc):
+    return bytes([block_id]) + raw_size.to_bytes(4, 'big') + stored_size.to_bytes(4, 'big') + crc.to_bytes(4, 'big')
+
+def encode_block(data, codec):
+    with stage("container.encode_block"):
+        codec, payload = codec.compress_block(data)
+    count(f"container.blocks.{codec.name}")
+    return encode_block_header(codec.codec_id, len(data), len(payload), zlib.crc32(data)), payload
+
+def encode_model_block(data, model, backend):
+    # the model's coding, or None when it does not even beat storing the block
+    with stage("container.encode_block"):
+        payload = model.compress(data, backend)
+    if len(payload) >= len(data):
+        return None
+    count("container.blocks.model")
+    return encode_block_header(MODEL_CODED_ID, len(data), len(payload), zlib.crc32(data)), payload
+
+def encode_model_record(raw):
+    # the model file, LZW coded (the JSON primer shrinks to about a third)
+    # raw size 0, the record adds nothing to the container's contents
+    payload = api.get_codec("lzw").compress(raw)
+    return encode_block_header(MODEL_RECORD_ID, 0, len(payload), zlib.crc32(raw)), payload
+
+def encode_index(entries):
+    return b''.join(offset.to_bytes(8, 'big') + raw_size.to_bytes(4, 'big') for offset, raw_size in entries)
+
+def encode_footer(index_offset, num_blocks):
+    return index_offset.to_bytes(8, 'big') + num_blocks.to_bytes(4, 'big') + FOOTER_MAGIC
+
+def encode_segment_footer(index_offset, num_blocks, previous_end):
+    return index_offset.to_bytes(8, 'big') + num_blocks.to_bytes(4, 'big') + previous_end.to_bytes(8, 'big') + SEGMENT_MAGIC
+
+def decode_header(header):
+    # (default codec id, block size)
+    if len(header) < HEADER_SIZE or header[:3] != FORMAT_MAGIC:
+        raise ValueError("Not a container file")
+    if header[3] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported container version: {header[3]}")
+    return header[4], int.from_bytes(header[5:9], 'big')
+
+def decode_footer(footer):
+    # (index offset, block count)
+    if len(footer) < FOOTER_SIZE or footer[12:] != FOOTER_MAGIC:
+        raise ValueError("Container footer is missing or truncated")
+    return int.from_bytes(footer[:8], 'big'), int.from_bytes(footer[8:12], 'big')
+
+def decode_index(index, num_blocks):
+    # [(file offset, raw size)] of every block
+    entries = []
+    for pos in range(0, num_blocks * INDEX_ENTRY_SIZE, INDEX_ENTRY_SIZE):
+        entries.append((int.from_bytes(index[pos:pos + 8], 'big'), int.from_bytes(index[pos + 8:pos + 12], 'big')))
+    return entries
+
+def read_index(read_at, end):
+    # [(file offset, raw size)] of every block of a container ending at offset
+    # end, following the segment footers back to the first footer;
+    # read_at(offset, size) returns those bytes of the file
+    segments = []
+    while read_at(end - 4, 4) == SEGMENT_MAGIC:
+        footer = read_at(end - SEGMENT_FOOTER_SIZE, SEGMENT_FOOTER_SIZE)
+        index_offset = int.from_bytes(footer[:8], 'big')
+        num_blocks = int.from_bytes(footer[8:12], 'big')
+        previous_end = int.from_bytes(footer[12:20], 'big')
+        if not HEADER_SIZE + FOOTER_SIZE <= previous_end < end:
+            raise ValueError("Corrupt container segment footer")
+        segments.append(decode_index(read_at(index_offset, num_blocks * INDEX_ENTRY_SIZE), num_blocks))
+        end = previous_end
+    index_offset, num_blocks = decode_footer(read_at(end - FOOTER_SIZE, FOOTER_SIZE))
+    segments.append(decode_index(read_at(index_offset, num_blocks * INDEX_ENTRY_SIZE), num_blocks))
+    return [entry for segment in reversed(segments) for entry in segment]
+
+
+class ContainerWriter:
+    # buffers writes into block_size blocks, the index is written by close().
+    # append=True adds a segment to an existing container: dst must be open for
+    # reading and writing, and codec and block_size default to the container's own
+
+    def __init__(self, dst, codec="huffman", block_size=DEFAULT_BLOCK_SIZE, reuse_model=None, append=False):
+        if reuse_model is not None and reuse_model not in models.BACKENDS:
+            raise ValueError(f"Unknown model backend: {reuse_model} (available: {', '.join(models.BACKENDS)})")
+        self.dst = dst
+        self.reuse_model = reuse_model
+        self.model = None
+        self.sample = bytearray()
+        self.pending = bytearray()
+        self.in_count = 0
+        self.entries = []  # blocks of this segment
+        self.previous = []  # blocks of the earlier segments
+        self.previous_end = None
+        if append:
+            dst.seek(0)
+            codec_id, block_size = decode_header(dst.read(HEADER_SIZE))
+            self.previous_end = dst.seek(0, 2)
+            self.previous = read_index(self.read_at, self.previous_end)
+            if codec is None:
+                codec = api.get_codec_by_id(codec_id).name
+        self.codec = api.get_codec(codec or "huffman")
+        if self.codec.codec_id is None:
+            raise ValueError(f"Codec {codec} has no container id")
+        self.block_size = block_size
+        if append:
+            if reuse_model is not None:
+                self.model = self.last_model()
+            # everything is checked before the first write, which goes after the old footer
+            self.offset = dst.seek(0, 2)
+        else:
+            self.offset = dst.write(encode_header(self.codec.codec_id, block_size))
+
+    def read_at(self, offset, size):
+        self.dst.seek(offset)
+        return self.dst.read(size)
+
+    @property
+    def held(self):
+        # uncompressed bytes already in the container before this segment
+        return sum(raw_size for _, raw_size in self.previous)
+
+    def last_model(self):
+        # the model record closing the previous segment, if any
+        for offset, _ in reversed(self.previous):
+            self.dst.seek(offset)
+            header = self.dst.read(BLOCK_HEADER_SIZE)
+            if header[0] == MODEL_RECORD_ID:
+                return models.Model(api.get_codec("lzw").decompress(self.dst.read(int.from_bytes(header[5:9], 'big'))))
+        return None
+
+    def write(self, data):
+        self.pending += data
+        self.in_count += len(data)
+        while len(self.pending) >= self.block_size:
+            self.flush_block(bytes(self.pending[:self.block_size]))
+            del self.pending[:self.block_size]
+
+    def flush_block(self, data):
+        block = None
+        if self.model is not None:
+            block = encode_model_block(data, self.model, self.reuse_model)
+            if block is None:
+                self.model = None  # stale, this segment gets a fresh one
+        if block is None:
+            block = encode_block(data, self.codec)
+            if self.reuse_model is not None:
+                self.sample += data
+                del self.sample[:-MODEL_SAMPLE]
+        header, payload = block
+        self.entries.append((self.offset, len(data)))
+        self.offset += self.dst.write(header) + self.dst.write(payload)
+
+    def close(self):
+        if self.pending:
+            self.flush_block(bytes(self.pending))
+            self.pending = bytearray()
+        if self.sample:
+            # only the lzw backend needs a dictionary primer
+            primer_size = models.DEFAULT_PRIMER_SIZE if self.reuse_model == "lzw" else 0
+            with stage("container.train_model"):
+                raw = json.dumps(models.train_bytes(bytes(self.sample), primer_size)).encode()
+            header, payload = encode_model_record(raw)
+            self.entries.append((self.offset, 0))
+            self.offset += self.dst.write(header) + self.dst.write(payload)
+            self.sample = bytearray()
+        index_offset = self.offset
+        if self.previous_end is None:
+            self.offset += self.dst.write(encode_index(self.entries))
+            self.offset += self.dst.write(encode_footer(index_offset, len(self.entries)))
+        elif self.entries:
+            self.offset += self.dst.write(encode_index(self.entries))
+            self.offset += self.dst.write(encode_segment_footer(index_offset, len(self.entries), self.previous_end))
+        return self.offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+class ContainerReader:
+    # random access over a container held in any buffer (bytes, mmap, memoryview)
+
+    def __init__(self, raw):
+        self.raw = memoryview(raw)
+        if len(raw) < HEADER_SIZE + FOOTER_SIZE:
+            raise ValueError("Not a container file")
+        self.codec_id, self.block_size = decode_header(raw[:HEADER_SIZE])
+        entries = read_index(lambda offset, size: self.raw[offset:offset + size], len(raw))
+
+        # raw_starts[i] is the uncompressed offset of block i, the last entry is the total size
+        self.offsets = []
+        self.raw_starts = [0]
+        for offset, raw_size in entries:
+            self.offsets.append(offset)
+            self.raw_starts.append(self.raw_starts[-1] + raw_size)
+        self.models = None  # model hash -> Model, filled on the first model-coded block
+
+    @property
+    def num_blocks(self):
+        return len(self.offsets)
+
+    @property
+    def size(self):
+        return self.raw_starts[-1]
+
+    def block_info(self, i):
+        pos = self.offsets[i]
+        header = self.raw[pos:pos + BLOCK_HEADER_SIZE]
+        if header[0] == MODEL_CODED_ID:
+            codec = "model"
+        elif header[0] == MODEL_RECORD_ID:
+            codec = "model-record"
+        else:
+            codec = api.get_codec_by_id(header[0]).name
+        return {
+            "codec": codec,
+            "offset": pos,
+            "raw_size": int.from_bytes(header[1:5], 'big'),
+            "stored_size": int.from_bytes(header[5:9], 'big'),
+            "crc32": int.from_bytes(header[9:13], 'big'),
+        }
+
+    def model(self, payload):
+        if self.models is None:
+            self.models = {}
+            for i in range(self.num_blocks):
+                if self.raw[self.offsets[i]] == MODEL_RECORD_ID:
+                    model = models.Model(self.read_record(i))
+                    self.models[model.hash] = model
+        model_hash = models.file_model_hash(payload)
+        if model_hash not in self.models:
+            raise ValueError(f"Container has no model {model_hash.hex()}")
+        return self.models[model_hash]
+
+    def read_record(self, i):
+        info = self.block_info(i)
+        start = info["offset"] + BLOCK_HEADER_SIZE
+        raw = api.get_codec("lzw").decompress(self.raw[start:start + info["stored_size"]])
+        if zlib.crc32(raw) != info["crc32"]:
+            raise ValueError(f"CRC mismatch in block {i}")
+        return raw
+
+    def read_block(self, i):
+        info = self.block_info(i)
+        if info["codec"] == "model-record":
+            self.read_record(i)
+            return b''
+        start = info["offset"] + BLOCK_HEADER_SIZE
+        payload = self.raw[start:start + info["stored_size"]]
+        with stage("container.decode_block"):
+            if info["codec"] == "model":
+                data = self.model(payload).decompress(payload)
+            else:
+                data = api.get_codec(info["codec"]).decompress(payload)
+        with stage("container.crc"):
+            if len(data) != info["raw_size"] or zlib.crc32(data) != info["crc32"]:
+                raise ValueError(f"CRC mismatch in block {i}")
+        return data
+
+    def iter_blocks(self):
+        for i in range(self.num_blocks):
+            yield self.read_block(i)
+
+    def read_range(self, offset, length):
+        # decode only the blocks overlapping [offset, offset + length)
+        end = min(offset + length, self.size)
+        if offset < 0 or length < 0:
+            raise ValueError("offset and length must not be negative")
+        if offset >= end:
+            return b''
+        first = bisect.bisect_right(self.raw_starts, offset) - 1
+        last = bisect.bisect_left(self.raw_starts, end) - 1
+        data = b''.join(self.read_block(i) for i in range(first, last + 1))
+        skip = offset - self.raw_starts[first]
+        return data[skip:skip + end - offset]
+
+
+def compress_stream(src, dst, codec="huffman", block_size=DEFAULT_BLOCK_SIZE, reuse_model=None):
+    return write_stream(src, ContainerWriter(dst, codec, block_size, reuse_model))
+
+def write_stream(src, writer):
+    while True:
+        chunk = src.read(writer.block_size)
+        if not chunk:
+            break
+        writer.write(chunk)
+    return writer.in_count, writer.close()
+
+def read_range(path, offset, length):
+    return ContainerReader(map_file(path)).read_range(offset, length)
+
+def pack(input_path, output_path, codec="huffman", block_size=DEFAULT_BLOCK_SIZE, reuse_model=None):
+    start_time = time.time()
+    with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+        original_size, compressed_size = compress_stream(src, dst, codec, block_size, reuse_model)
+    end_time = time.time()
+
+    print(f"Packed '{input_path}' : '{output_path}' with {codec}")
+    print(f"Time taken: {end_time - start_time:.4f} seconds")
+    print(f"Original size: {original_size} bytes")
+    print(f"Compressed size: {compressed_size} bytes")
+    print(f"Compression ratio: {original_size / compressed_size if compressed_size else 0:.2f}")
+
+def append(input_path, container_path, codec=None, reuse_model=None, tail=False):
+    # the whole input is added, unless tail: then the input is the grown file
+    # itself and only the bytes past what the container already holds are added
+    start_time = time.time()
+    with open(input_path, 'rb') as src, open(container_path, 'r+b') as dst:
+        old_size = dst.seek(0, 2)
+        writer = ContainerWriter(dst, codec, reuse_model=reuse_model, append=True)
+        if tail:
+            held = writer.held
+            input_size = src.seek(0, 2)
+            if input_size < held:
+                raise ValueError(f"'{input_path}' is {input_size} bytes but the container already holds {held}, "
+                                 "was it rotated or truncated?")
+            src.seek(held)
+        try:
+            appended_size, compressed_size = write_stream(src, writer)
+        except BaseException:
+            # drop the partial segment, the file ends in the old footer again
+            dst.truncate(old_size)
+            raise
+    end_time = time.time()
+
+    print(f"Appended '{input_path}' to '{container_path}' with {writer.codec.name}"
+          f"{f' reusing the {reuse_model} model' if writer.model is not None else ''}")
+    print(f"Time taken: {end_time - start_time:.4f} seconds")
+    print(f"Appended size: {appended_size} bytes")
+    print(f"Container grew by: {compressed_size - old_size} bytes")
+    print(f"Compressed size: {compressed_size} bytes")
+
+def unpack(input_path, output_path):
+    start_time = time.time()
+    decompressed_size = write_chunks(output_path, ContainerReader(map_file(input_path)).iter_blocks())
+    end_time = time.time()
+
+    print(f"Unpacked '{input_path}' : '{output_path}'")
+    print(f"Time taken: {end_time - start_time:.4f} seconds")
+    print(f"Decompressed size: {decompressed_size} bytes")
+
+def info(input_path):
+    reader = ContainerReader(map_file(input_path))
+    print(f"Codec: {api.get_codec_by_id(reader.codec_id).name}")
+    print(f"Block size: {reader.block_size} bytes")
+    print(f"Blocks: {reader.num_blocks}")
+    print(f"Original size: {reader.size} bytes")
+    for i in range(reader.num_blocks):
+        block = reader.block_info(i)
+        print(f"{i:>6} {block['codec']:<20} offset {block['offset']:>12}  "
+              f"{block['raw_size']:>10} -> {block['stored_size']:>10}  crc {block['crc32']:08x}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Block container with per-block CRC32 and random access")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    pack_parser = subparsers.add_parser("pack", help="Compress a file into a container")
+    pack_parser.add_argument("input", help="Input file path")
+    pack_parser.add_argument("output", help="Container output path")
+    pack_parser.add_argument("--codec", default="huffman", help="Codec name, see 'api.py list' (default: huffman)")
+    pack_parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE,
+                             help=f"Uncompressed bytes per block (default: {DEFAULT_BLOCK_SIZE})")
+    pack_parser.add_argument("--speed-weight", type=float, default=autoselect.DEFAULT_SPEED_WEIGHT,
+                             help="auto codec only: 0 picks the smallest output, larger values favour faster codecs "
+                                  f"(default: {autoselect.DEFAULT_SPEED_WEIGHT})")
+
+    pack_parser.add_argument("--reuse-model", choices=list(models.BACKENDS), default=None,
+                             help="Store a model of the data so later appends are coded against it with this backend")
+
+    append_parser = subparsers.add_parser("append", help="Add data to an existing container as new blocks")
+    append_parser.add_argument("input", help="File with the new data")
+    append_parser.add_argument("output", help="Container to extend")
+    append_parser.add_argument("--codec", default=None, help="Codec for the new blocks (default: the container's)")
+    append_parser.add_argument("--tail", action="store_true",
+                               help="Input is the whole grown file, add only the bytes past the container's size")
+    append_parser.add_argument("--reuse-model", choices=list(models.BACKENDS), default=None,
+                               help="Code the new blocks against the previous segment's stored model with this "
+                                    "backend, and store a model of this segment for the next append")
+    append_parser.add_argument("--speed-weight", type=float, default=autoselect.DEFAULT_SPEED_WEIGHT,
+                               help=f"auto codec only, see pack (default: {autoselect.DEFAULT_SPEED_WEIGHT})")
+
+    unpack_parser = subparsers.add_parser("unpack", help="Decompress a whole container")
+    unpack_parser.add_argument("input", help="Container path")
+    unpack_parser.add_argument("output", help="Output file path")
+
+    range_parser = subparsers.add_parser("range", help="Decompress a byte range, decoding only the blocks it covers")
+    range_parser.add_argument("input", help="Container path")
+    range_parser.add_argument("offset", type=int, help="Uncompressed start offset")
+    range_parser.add_argument("length", type=int, help="Number of bytes to read")
+    range_parser.add_argument("--output", help="Write the bytes here instead of stdout")
+
+    info_parser = subparsers.add_parser("info", help="List the blocks of a container")
+    info_parser.add_argument("input", help="Container path")
+    for subparser in (pack_parser, append_parser, unpack_parser, range_parser, info_parser):
+        instrument.add_arguments(subparser)
+
+    args = parser.parse_args()
+    instrument.configure(args)
+
+    if args.mode == "pack":
+        api.get_codec("auto").speed_weight = args.speed_weight
+        pack(args.input, args.output, args.codec, args.block_size, args.reuse_model)
+    elif args.mode == "append":
+        api.get_codec("auto").speed_weight = args.speed_weight
+        append(args.input, args.output, args.codec, args.reuse_model, args.tail)
+    elif args.mode == "unpack":
+        unpack(args.input, args.output)
+    elif args.mode == "range":
+        data = read_range(args.input, args.offset, args.length)
+        if args.output:
+            with open(args.output, 'wb') as f:
+                f.write(data)
+        else:
+            sys.stdout.buffer.write(data)
+    else:
+        info(args.input)
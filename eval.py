@@ -1,82 +1,161 @@
-import subprocess
-import os
-import filecmp
-import re
+import argparse
 import csv
+import json
+import math
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import api
+import generate_test_files
+from bench import mb_per_s
+
+# rows are keyed by (codec, file) when comparing against a baseline
+FIELDS = [
+    "file", "distribution", "size", "codec", "compressed_size", "ratio",
+    "compress_mb_s", "compress_mb_s_p95", "decompress_mb_s", "decompress_mb_s_p95",
+    "compress_peak_bytes", "decompress_peak_bytes", "correct", "sha256",
+]
+
+
+def percentile(values, pct):
+    # nearest-rank percentile
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def time_runs(func, arg, warmup, repeat):
+    for _ in range(warmup):
+        func(arg)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+def peak_memory(func, arg):
+    tracemalloc.start()
+    try:
+        func(arg)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def find_inputs(test_dir):
+    # (path, distribution, sha256); a generated corpus is read from its manifest,
+    # any other directory is walked and has no checksums
+    manifest = generate_test_files.load_manifest(test_dir)
+    if manifest is not None:
+        return [(os.path.join(test_dir, entry["path"]), entry["family"], entry["sha256"]) for entry in manifest["files"]]
+    inputs = []
+    for root, _, files in os.walk(test_dir):
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            inputs.append((path, os.path.basename(root), None))
+    return sorted(inputs, key=lambda item: (item[1], os.path.getsize(item[0]), item[0]))
+
+def bench_one(path, distribution, codec_name, warmup, repeat, measure_memory, checksum=None):
+    codec = api.get_codec(codec_name)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    compressed, comp_times = time_runs(codec.compress, data, warmup, repeat)
+    decompressed, decomp_times = time_runs(codec.decompress, compressed, warmup, repeat)
+
+    # p95 throughput is taken at the 95th percentile (slow tail) run time
+    row = {
+        "file": path,
+        "distribution": distribution,
+        "size": len(data),
+        "codec": codec_name,
+        "compressed_size": len(compressed),
+        "ratio": len(data) / len(compressed) if compressed else 0,
+        "compress_mb_s": mb_per_s(len(data), statistics.median(comp_times)),
+        "compress_mb_s_p95": mb_per_s(len(data), percentile(comp_times, 95)),
+        "decompress_mb_s": mb_per_s(len(data), statistics.median(decomp_times)),
+        "decompress_mb_s_p95": mb_per_s(len(data), percentile(decomp_times, 95)),
+        "compress_peak_bytes": peak_memory(codec.compress, data) if measure_memory else None,
+        "decompress_peak_bytes": peak_memory(codec.decompress, compressed) if measure_memory else None,
+        "correct": decompressed == data,
+        "sha256": checksum,
+    }
+    return row
+
+def evaluate(test_dir, codecs, warmup=1, repeat=5, max_size=None, measure_memory=True):
+    results = []
+    for path, distribution, checksum in find_inputs(test_dir):
+        if max_size is not None and os.path.getsize(path) > max_size:
+            continue
+        for codec_name in codecs:
+            row = bench_one(path, distribution, codec_name, warmup, repeat, measure_memory, checksum)
+            results.append(row)
+            print(f"{codec_name:<20} {path:<50} ratio {row['ratio']:6.2f}  "
+                  f"comp {row['compress_mb_s']:8.3f} MB/s  decomp {row['decompress_mb_s']:8.3f} MB/s"
+                  f"{'' if row['correct'] else '  MISMATCH'}")
+    return results
+
+def save_results(results, json_path=None, csv_path=None):
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    if csv_path:
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {(row["codec"], row["file"]): row for row in json.load(f)}
+
+    regressions = []
+    for row in results:
+        base = baseline.get((row["codec"], row["file"]))
+        if base is None:
+            continue
+        if base.get("sha256") and row["sha256"] and base["sha256"] != row["sha256"]:
+            continue  # generated from another seed, the numbers are not comparable
+        for metric in ("ratio", "compress_mb_s", "decompress_mb_s"):
+            if base[metric] and row[metric] < base[metric] * (1 - threshold):
+                regressions.append((row["codec"], row["file"], metric, base[metric], row[metric]))
+    return regressions
 
-# Compression tool configs
-algorithms = {
-    "huffman": {"script": "huffman.py", "ext": ".huff"},
-    "arithmetic": {"script": "arithmetic.py", "ext": ".arith"},
-    "lzw": {"script": "lzw.py", "ext": ".lzw"},
-}
-
-test_dir = "test_files\\uniform"
-results = []
-
-def run_and_capture(cmd):
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    if result.returncode != 0:
-        print("Error running command:", cmd)
-        print("stdout:", result.stdout)
-        print("stderr:", result.stderr)
-        result.check_returncode()  # raises exception
-    return result.stdout
-
-
-def parse_output(output):
-    """Extract time and compression ratio from stdout"""
-    time_match = re.search(r"Time taken:\s*([\d.]+)", output)
-    ratio_match = re.search(r"Compression ratio:\s*([\d.]+)", output)
-    return (
-        float(time_match.group(1)) if time_match else -1,
-        float(ratio_match.group(1)) if ratio_match else -1,
-    )
-
-def evaluate():
-    file_path = test_dir
-    for filename in os.listdir(file_path):
-        print(filename)
-        input_path = os.path.join(file_path, filename)
-        for algo, config in algorithms.items():
-            filename_without_ext = os.path.splitext(filename)[0]
-            compressed = f"{filename_without_ext}_{algo}{config['ext']}"
-            decompressed = f"{filename_without_ext}_{algo}_decoded.txt"
-
-            print(f"Testing {algo} on {filename} {compressed}")
-
-            # Compress
-            comp_cmd = f"python {config['script']} compress {input_path} {compressed}"
-            comp_out = run_and_capture(comp_cmd)
-            comp_time, ratio = parse_output(comp_out)
-
-            # Decompress
-            decomp_cmd = f"python {config['script']} decompress {compressed} {decompressed}"
-            decomp_out = run_and_capture(decomp_cmd)
-            time_match = re.search(r"Time taken:\s*([\d.]+)", decomp_out)
-            decomp_time=float(time_match.group(1)) if time_match else -1
-            correct = filecmp.cmp(input_path, decompressed, shallow=False)
-
-            results.append({
-                "file": filename,
-                "algorithm": algo,
-                "compression_time": comp_time,
-                "decompression_time": decomp_time,
-                "compression_ratio": ratio,
-                "correct": correct,
-            })
-
-            # Clean up
-            os.remove(compressed)
-            os.remove(decompressed)
-
-def save_results():
-    with open("results_uniform.csv", "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=results[0].keys())
-        writer.writeheader()
-        writer.writerows(results)
 
 if __name__ == "__main__":
-    evaluate()
-    save_results()
-    print("✓ Evaluation complete. Results saved to results.csv")
+    parser = argparse.ArgumentParser(description="In-process benchmark of every registered codec")
+    parser.add_argument("test_dir", nargs="?", default="test_files", help="Directory of input files (default: test_files)")
+    parser.add_argument("--codecs", nargs="+", default=api.available_codecs(), help="Codecs to run (default: all registered)")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs before measuring (default: 1)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per measurement (default: 5)")
+    parser.add_argument("--max-size", type=int, default=None, help="Skip inputs larger than this many bytes")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc peak memory runs")
+    parser.add_argument("--json", default="results.json", help="JSON output path (default: results.json)")
+    parser.add_argument("--csv", default="results.csv", help="CSV output path (default: results.csv)")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", help="Flag regressions against an earlier --json output")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative drop in ratio or throughput counted as a regression (default: 0.10)")
+
+    parser.add_argument("--verify", action="store_true", help="Check the inputs against the corpus manifest first")
+
+    args = parser.parse_args()
+
+    if args.verify:
+        bad = generate_test_files.verify(args.test_dir)
+        for path in bad:
+            print(f"MISMATCH {path}")
+        if bad:
+            sys.exit(1)
+
+    results = evaluate(args.test_dir, args.codecs, args.warmup, args.repeat, args.max_size, not args.no_memory)
+    save_results(results, args.json, args.csv)
+    print(f"✓ Evaluation complete. Results saved to {args.json} and {args.csv}")
+
+    failed = [row for row in results if not row["correct"]]
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+    for codec_name, path, metric, old, new in regressions:
+        print(f"REGRESSION {codec_name} {path}: {metric} {old:.3f} -> {new:.3f}")
+    if failed or regressions:
+        sys.exit(1)
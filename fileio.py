@@ -0,0 +1,44 @@
+import mmap
+import os
+import sys
+
+from instrument import count, stage
+
+CHUNK_SIZE = 1 << 20
+STDIO = "-"  # path meaning stdin for map_file and stdout for write_chunks
+
+
+def map_file(path):
+    # read-only memoryview over the whole file, backed by mmap so the
+    # codecs can scan it without pulling a private copy into memory
+    if path == STDIO:
+        with stage("io.map"):
+            data = sys.stdin.buffer.read()
+        count("io.bytes_mapped", len(data))
+        return memoryview(data)
+    with stage("io.map"), open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        count("io.bytes_mapped", size)
+        if size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def write_chunks(path, chunks):
+    if path == STDIO:
+        # flushed per chunk so a downstream reader gets data as soon as it is decoded
+        written = _write_chunks(sys.stdout.buffer, chunks, flush=True)
+    else:
+        with open(path, 'wb') as f:
+            written = _write_chunks(f, chunks)
+    count("io.bytes_written", written)
+    return written
+
+def _write_chunks(f, chunks, flush=False):
+    written = 0
+    for chunk in chunks:
+        with stage("io.write"):
+            f.write(chunk)
+            if flush:
+                f.flush()
+        written += memoryview(chunk).nbytes  # len() of a bitarray counts bits
+    return written
@@ -1,10 +1,22 @@
-import os
+import argparse
+import hashlib
+import json
 import random
+import time
 from pathlib import Path
 
-# Define base output directory
-base_dir = Path("test_files")
-base_dir.mkdir(exist_ok=True)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# every file gets its own generator seeded from (seed, family, size), so a file's
+# bytes don't depend on which other files are generated; the numpy and pure
+# Python paths each reproduce themselves but not each other
+DEFAULT_SEED = 1234
+CHUNK_SIZE = 1 << 20
+MANIFEST_NAME = "manifest.json"
+USE_NUMPY = np is not None
 
 # Character distributions to simulate different file types
 charsets = {
@@ -24,27 +36,236 @@ sizes_bytes = [
     100 * 1024 * 1024    # 100 MB
 ]
 
-# Function to generate file content
-def generate_content(charset, size_bytes):
-    return ''.join(random.choices(charset, k=size_bytes))
-
-# Generate files
-for dist_name, charset in charsets.items():
-    dist_dir = base_dir / dist_name
-    dist_dir.mkdir(parents=True, exist_ok=True)
-    
-    for size_bytes in sizes_bytes:
-        size_label = (
-            f"{size_bytes // 1024}KB" if size_bytes < 1024 * 1024
-            else f"{size_bytes // (1024 * 1024)}MB"
-        )
-        file_name = f"{dist_name}_{size_label}.txt"
-        file_path = dist_dir / file_name
-        
-        print(f"Generating {file_name} ...")
-        content = generate_content(charset, size_bytes)
-        
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
-
-print("✅ All test files generated at:", base_dir.resolve())
+# zipf_text: words drawn from a made-up vocabulary with Zipf ranks, like natural language
+VOCAB_SIZE = 5000
+ZIPF_EXPONENT = 1.2
+LETTERS = "etaoinshrdlcumwfgypbvkjxqz"
+LETTER_WEIGHTS = [12.7, 9.1, 8.2, 7.5, 7.0, 6.7, 6.3, 6.1, 6.0, 4.3, 4.0, 2.8, 2.8, 2.4, 2.4, 2.2, 2.0,
+                  2.0, 1.9, 1.5, 1.0, 0.8, 0.2, 0.2, 0.1, 0.1]
+NEWLINE_EVERY = 12  # about one word in this many ends a line
+
+# logs: a handful of templates with changing ids and timings, like a service log
+LOG_LEVELS = ["INFO"] * 80 + ["DEBUG"] * 12 + ["WARN"] * 6 + ["ERROR"] * 2
+LOG_TEMPLATES = [
+    ("http", "GET /api/users/{id} {status} {ms}ms"),
+    ("http", "POST /api/orders {status} {ms}ms"),
+    ("db", "query users.by_id took {ms}ms rows={rows}"),
+    ("db", "connection pool size={rows} waiting=0"),
+    ("cache", "miss key=user:{id}"),
+    ("cache", "hit key=session:{id}"),
+    ("auth", "token refreshed for user {id}"),
+    ("worker", "job {id} finished in {ms}ms"),
+]
+LOG_STATUSES = [200] * 90 + [201] * 4 + [404] * 4 + [500] * 2
+
+# csv: rows like data/iris.data.txt, per-class means and spreads of the four measurements
+CSV_CLASSES = [
+    ("Iris-setosa", (5.0, 3.4, 1.5, 0.2), (0.35, 0.38, 0.17, 0.1)),
+    ("Iris-versicolor", (5.9, 2.8, 4.3, 1.3), (0.52, 0.31, 0.47, 0.2)),
+    ("Iris-virginica", (6.6, 3.0, 5.6, 2.0), (0.64, 0.32, 0.55, 0.27)),
+]
+CSV_RUN = 50  # rows of one class in a row, as in the iris file
+
+FAMILY_SUFFIX = {"zipf_text": ".txt", "logs": ".log", "csv": ".csv", "random": ".bin"}
+
+
+def file_seed(seed, family, size):
+    return int.from_bytes(hashlib.sha256(f"{seed}:{family}:{size}".encode()).digest()[:8], 'big')
+
+def make_rng(seed):
+    return np.random.default_rng(seed) if USE_NUMPY else random.Random(seed)
+
+def python_rng(rng):
+    # random.Random seeded from rng, for the generators that are formatting-bound anyway
+    return random.Random(int(rng.integers(1 << 62)) if USE_NUMPY else rng.getrandbits(62))
+
+
+def iter_charset(rng, charset):
+    table = "".join(charset).encode()
+    if USE_NUMPY:
+        table = np.frombuffer(table, dtype=np.uint8)
+        while True:
+            yield table[rng.integers(0, len(table), CHUNK_SIZE)].tobytes()
+    while True:
+        yield bytes(rng.choices(table, k=CHUNK_SIZE))
+
+def make_vocabulary(rng):
+    # word lengths 1..10 peaking around 4, letters by English frequency
+    py_rng = python_rng(rng)
+    words = set()
+    while len(words) < VOCAB_SIZE:
+        length = min(10, max(1, round(py_rng.gauss(4.5, 2))))
+        words.add("".join(py_rng.choices(LETTERS, LETTER_WEIGHTS, k=length)))
+    return [word.encode() + b" " for word in sorted(words, key=lambda word: (len(word), word))]
+
+def iter_zipf_text(rng):
+    vocab = make_vocabulary(rng)
+    if USE_NUMPY:
+        # every word keeps its trailing space in one flat buffer, a chunk is a single gather
+        lengths = np.array([len(word) for word in vocab])
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        flat = np.frombuffer(b"".join(vocab), dtype=np.uint8)
+        count = CHUNK_SIZE // 5
+        while True:
+            ranks = (rng.zipf(ZIPF_EXPONENT, count) - 1) % VOCAB_SIZE
+            word_lengths = lengths[ranks]
+            ends = np.cumsum(word_lengths)
+            index = np.arange(ends[-1]) + np.repeat(starts[ranks] - (ends - word_lengths), word_lengths)
+            out = flat[index]
+            out[ends[rng.random(count) < 1 / NEWLINE_EVERY] - 1] = ord("\n")
+            yield out.tobytes()
+    cum_weights = []
+    total = 0.0
+    for rank in range(VOCAB_SIZE):
+        total += 1 / (rank + 1) ** ZIPF_EXPONENT
+        cum_weights.append(total)
+    newline = [word[:-1] + b"\n" for word in vocab]
+    while True:
+        ranks = rng.choices(range(VOCAB_SIZE), cum_weights=cum_weights, k=CHUNK_SIZE // 5)
+        yield b"".join(newline[r] if rng.random() < 1 / NEWLINE_EVERY else vocab[r] for r in ranks)
+
+def iter_logs(rng):
+    # formatting dominates here, so both paths use the same Python generator
+    py_rng = python_rng(rng)
+    now = 1704067200.0  # 2024-01-01T00:00:00Z
+    stamp_second = None
+    while True:
+        lines = []
+        size = 0
+        while size < CHUNK_SIZE:
+            now += py_rng.expovariate(200)
+            second = int(now)
+            if second != stamp_second:
+                stamp_second = second
+                stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+            component, template = py_rng.choice(LOG_TEMPLATES)
+            message = template.format(id=py_rng.randrange(1, 100000), status=py_rng.choice(LOG_STATUSES),
+                                      ms=int(py_rng.lognormvariate(2.5, 1)), rows=py_rng.randrange(1, 64))
+            line = f"{stamp}.{int(now * 1000) % 1000:03d}Z {py_rng.choice(LOG_LEVELS):<5} [{component}] {message}\n"
+            lines.append(line)
+            size += len(line)
+        yield "".join(lines).encode()
+
+def iter_csv(rng):
+    py_rng = python_rng(rng)
+    while True:
+        rows = []
+        size = 0
+        while size < CHUNK_SIZE:
+            name, means, spreads = py_rng.choice(CSV_CLASSES)
+            for _ in range(CSV_RUN):
+                values = ",".join(f"{max(0.1, py_rng.gauss(mean, spread)):.1f}" for mean, spread in zip(means, spreads))
+                row = f"{values},{name}\n"
+                rows.append(row)
+                size += len(row)
+        yield "".join(rows).encode()
+
+def iter_random(rng):
+    while True:
+        yield rng.bytes(CHUNK_SIZE) if USE_NUMPY else rng.randbytes(CHUNK_SIZE)
+
+def family_chunks(family, rng):
+    if family in charsets:
+        return iter_charset(rng, charsets[family])
+    return {"zipf_text": iter_zipf_text, "logs": iter_logs, "csv": iter_csv, "random": iter_random}[family](rng)
+
+FAMILIES = list(charsets) + list(FAMILY_SUFFIX)
+
+
+def size_label(size_bytes):
+    return f"{size_bytes // 1024}KB" if size_bytes < 1024 * 1024 else f"{size_bytes // (1024 * 1024)}MB"
+
+def write_file(path, chunks, size_bytes):
+    # streams exactly size_bytes from the family's chunks, hashing as it goes
+    digest = hashlib.sha256()
+    remaining = size_bytes
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            chunk = chunk[:remaining]
+            f.write(chunk)
+            digest.update(chunk)
+            remaining -= len(chunk)
+            if not remaining:
+                break
+    return digest.hexdigest()
+
+def load_manifest(base_dir):
+    path = Path(base_dir) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def generate(base_dir, families=FAMILIES, sizes=sizes_bytes, seed=DEFAULT_SEED):
+    base_dir = Path(base_dir)
+    base_dir.mkdir(parents=True, exist_ok=True)
+    # entries from earlier runs are kept unless this run rewrites them
+    manifest = load_manifest(base_dir) or {}
+    entries = {entry["path"]: entry for entry in manifest.get("files", [])}
+    for family in families:
+        dist_dir = base_dir / family
+        dist_dir.mkdir(parents=True, exist_ok=True)
+        for size_bytes in sizes:
+            file_name = f"{family}_{size_label(size_bytes)}{FAMILY_SUFFIX.get(family, '.txt')}"
+            print(f"Generating {file_name} ...")
+            chunks = family_chunks(family, make_rng(file_seed(seed, family, size_bytes)))
+            checksum = write_file(dist_dir / file_name, chunks, size_bytes)
+            path = f"{family}/{file_name}"
+            entries[path] = {"path": path, "family": family, "size": size_bytes, "sha256": checksum}
+
+    manifest = {
+        "seed": seed,
+        "generator": "numpy" if USE_NUMPY else "python",
+        "files": sorted(entries.values(), key=lambda entry: (entry["family"], entry["size"], entry["path"])),
+    }
+    with open(base_dir / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    return manifest
+
+def verify(base_dir):
+    # paths whose size or checksum no longer match the manifest
+    manifest = load_manifest(base_dir)
+    if manifest is None:
+        raise ValueError(f"No {MANIFEST_NAME} in {base_dir}")
+    bad = []
+    for entry in manifest["files"]:
+        digest = hashlib.sha256()
+        path = Path(base_dir) / entry["path"]
+        if not path.exists() or path.stat().st_size != entry["size"]:
+            bad.append(entry["path"])
+            continue
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != entry["sha256"]:
+            bad.append(entry["path"])
+    return bad
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the seeded benchmark corpus and its manifest")
+    parser.add_argument("output", nargs="?", default="test_files", help="Output directory (default: test_files)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help=f"Corpus seed (default: {DEFAULT_SEED})")
+    parser.add_argument("--families", nargs="+", choices=FAMILIES, default=FAMILIES,
+                        help="Families to generate (default: all)")
+    parser.add_argument("--max-size", type=int, default=None, help="Skip sizes above this many bytes")
+    parser.add_argument("--no-numpy", action="store_true", help="Use the pure Python generators")
+    parser.add_argument("--verify", action="store_true", help="Check existing files against the manifest instead")
+
+    args = parser.parse_args()
+    if args.no_numpy:
+        USE_NUMPY = False
+
+    start_time = time.time()
+    if args.verify:
+        bad = verify(args.output)
+        for path in bad:
+            print(f"MISMATCH {path}")
+        print(f"{'✓ Manifest matches' if not bad else f'{len(bad)} files differ from the manifest'}")
+        raise SystemExit(1 if bad else 0)
+
+    sizes = [size for size in sizes_bytes if args.max_size is None or size <= args.max_size]
+    generate(args.output, args.families, sizes, args.seed)
+    print(f"Time taken: {time.time() - start_time:.4f} seconds")
+    print("✅ All test files generated at:", Path(args.output).resolve())
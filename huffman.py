@@ -1,10 +1,29 @@
 import argparse
 import json
+import sys
 import heapq
-from pathlib import Path
-from collections import defaultdict
+import re
+from collections import Counter
+from itertools import islice
 import time
-import os
+from concurrent.futures import ProcessPoolExecutor
+from bitarray import bitarray, decodetree
+from fileio import CHUNK_SIZE, STDIO, map_file, write_chunks
+import instrument
+from instrument import count, stage, timed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FORMAT_MAGIC = b'HUF'
+FORMAT_VERSION = 1
+BLOCK_FORMAT_VERSION = 2
+DEFAULT_BLOCK_SIZE = 1 << 20
+USE_NUMPY = np is not None
+NUMPY_MIN_SIZE = 1 << 12  # smaller inputs are faster on the scalar path
+NUMPY_CHUNK = 1 << 20     # codes per vectorized pass, bounds the temporary arrays
 
 class HuffmanNode:
     def __init__(self, char=None, freq=0):
@@ -17,13 +36,18 @@ class HuffmanNode:
         return self.freq < other.freq
 
 def build_frequency_table(data):
-    freq = defaultdict(int)
-    for symbol in data:
-        freq[symbol] += 1
-    return dict(freq)
+    # sorted by symbol on both paths (the static arithmetic header relies on it)
+    if USE_NUMPY and len(data) >= NUMPY_MIN_SIZE:
+        symbols = np.frombuffer(data, dtype=np.uint8)
+        counts = np.zeros(256, dtype=np.int64)
+        for i in range(0, len(symbols), NUMPY_CHUNK):  # bincount widens its input to int64
+            counts += np.bincount(symbols[i:i + NUMPY_CHUNK], minlength=256)
+        return {symbol: count for symbol, count in enumerate(counts.tolist()) if count}
+    return dict(sorted(Counter(data).items()))
 
 def build_huffman_tree(freq_table):
-    heap = [HuffmanNode(char, freq) for char, freq in freq_table.items()]
+    # sorted so ties break the same way whichever path built the table
+    heap = [HuffmanNode(char, freq) for char, freq in sorted(freq_table.items())]
     heapq.heapify(heap)
     while len(heap) > 1:
         node1 = heapq.heappop(heap)
@@ -38,117 +62,364 @@ def generate_codes(node, prefix="", code_map=None):
     if code_map is None:
         code_map = {}
     if node.char is not None:
-        code_map[node.char] = prefix
+        code_map[node.char] = prefix or "0"  # a lone symbol still needs one bit
     else:
         generate_codes(node.left, prefix + "0", code_map)
         generate_codes(node.right, prefix + "1", code_map)
     return code_map
 
+def canonical_codes(lengths):
+    # symbols sorted by (length, symbol) get consecutive codes, so the
+    # lengths alone are enough to rebuild the same code on both sides
+    codes = {}
+    code = 0
+    prev_length = 0
+    for symbol, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+        code <<= length - prev_length
+        codes[symbol] = (code, length)
+        code += 1
+        prev_length = length
+    return codes
+
+def pack_code_lengths(lengths):
+    # lowest symbol, highest symbol, then one length byte per symbol in between (0 = unused)
+    if not lengths:
+        return bytes([1, 0])
+    low, high = min(lengths), max(lengths)
+    return bytes([low, high]) + bytes(lengths.get(symbol, 0) for symbol in range(low, high + 1))
+
+def unpack_code_lengths(buf, pos=0):
+    low, high = buf[pos], buf[pos + 1]
+    pos += 2
+    lengths = {}
+    for symbol in range(low, high + 1):
+        if buf[pos]:
+            lengths[symbol] = buf[pos]
+        pos += 1
+    return lengths, pos
+
 def encode_data(data, code_map):
-    return ''.join(code_map[byte] for byte in data)
-
-def pad_encoded_data(encoded_data):
-    extra_padding = 8 - len(encoded_data) % 8
-    if extra_padding == 8:
-        extra_padding = 0
-    padded = encoded_data + '0' * extra_padding
-    return padded, extra_padding
-
-def get_byte_array(bitstring):
-    return bytearray(int(bitstring[i:i+8], 2) for i in range(0, len(bitstring), 8))
-
-def rebuild_tree_from_code_map(code_map):
-    root = {}
-    for k, v in code_map.items():
-        node = root
-        for bit in v:
-            node = node.setdefault(bit, {})
-        node['char'] = int(k)
-    return root
-
-def decode_bits(bitstring, tree):
-    decoded_bytes = bytearray()
-    node = tree
-    for bit in bitstring:
-        node = node[bit]
-        if 'char' in node:
-            decoded_bytes.append(node['char'])
-            node = tree
-    return bytes(decoded_bytes)
-
-def compress(input_path, output_path):
-    start_time = time.time()
-    data = Path(input_path).read_bytes()
-    original_size = len(data)
+    # bitarray.encode walks the input in C and appends each code to one packed buffer
+    if not code_map:
+        return b'', 0
+    bits = bitarray()
+    bits.encode({symbol: bitarray(code) for symbol, code in code_map.items()}, data)
+    padding = bits.fill()  # zero the pad bits, the raw buffer is written as is
+    return bits, padding  # the bitarray itself is a bytes-like buffer, no copy needed
 
-    freq_table = build_frequency_table(data)
-    root = build_huffman_tree(freq_table)
-    code_map = generate_codes(root)
-    encoded = encode_data(data, code_map)
-    padded, padding = pad_encoded_data(encoded)
-    byte_array = get_byte_array(padded)
+def encode_data_numpy(data, codes):
+    # same bits as encode_data: every code is shifted to its cumsum bit offset and OR-ed
+    # into big-endian 32-bit words, two symbols per code when both fit in 16 bits
+    lengths = np.zeros(256, dtype=np.int64)
+    values = np.zeros(256, dtype=np.uint64)
+    for symbol, (value, length) in codes.items():
+        lengths[symbol] = length
+        values[symbol] = value
+    symbols = np.frombuffer(data, dtype=np.uint8)
 
-    metadata = {
-        'code_map': {str(k): v for k, v in code_map.items()},
-        'padding': padding
-    }
+    if lengths.max() <= 16:
+        pairs = np.arange(1 << 16)
+        first, second = pairs & 0xff, pairs >> 8  # little-endian view: low byte comes first
+        pair_lengths = lengths[first] + lengths[second]
+        pair_values = (values[first] << lengths[second].astype(np.uint64)) | values[second]
+        step = 2 * NUMPY_CHUNK
+    else:
+        pair_lengths = None
+        step = NUMPY_CHUNK
 
-    with open(output_path, 'wb') as f:
-        header = json.dumps(metadata).encode()
-        f.write(len(header).to_bytes(4, 'big'))  # Write 4-byte header size
-        f.write(header)
-        f.write(byte_array)
+    out = bytearray()
+    carry = 0     # partial last word of the previous pass
+    bit_pos = 0   # bits already used in it
+    for i in range(0, len(symbols), step):
+        chunk = symbols[i:i + step]
+        if pair_lengths is not None:
+            even = len(chunk) & ~1  # only the last chunk can be odd
+            index = chunk[:even].view('<u2')
+            chunk_lengths = np.concatenate((pair_lengths[index], lengths[chunk[even:]]))
+            chunk_values = np.concatenate((pair_values[index], values[chunk[even:]]))
+        else:
+            chunk_lengths = lengths[chunk]
+            chunk_values = values[chunk]
+        end = np.cumsum(chunk_lengths) + bit_pos
+        start = end - chunk_lengths
+        total = int(end[-1])
+        # each code (at most 32 bits) lands in the top of a 64-bit lane: high half to
+        # word start >> 5, low half to the next word; codes never share bits, so OR is exact
+        shifted = chunk_values << (64 - (start & 31) - chunk_lengths).astype(np.uint64)
+        word = start >> 5
+        segments = np.concatenate(([0], np.flatnonzero(np.diff(word)) + 1))
+        high = np.bitwise_or.reduceat(shifted >> np.uint64(32), segments)
+        words = np.zeros(len(high) + 1, dtype=np.uint64)
+        words[:-1] = high
+        words[1:] |= np.bitwise_or.reduceat(shifted & np.uint64(0xffffffff), segments)
+        words[0] |= carry
+        full = total >> 5
+        out += words[:full].astype('>u4').tobytes()
+        carry, bit_pos = int(words[full]), total & 31
+    if bit_pos:
+        out += carry.to_bytes(4, 'big')[:(bit_pos + 7) // 8]
+    return out, -bit_pos % 8
 
-    end_time = time.time()
-    compressed_size = os.path.getsize(output_path)
+def build_decode_tree(codes):
+    # codes maps symbol -> (code value, code length). bitarray walks the prefix
+    # tree in C, several times faster than a Python lookup table per code
+    codes = {symbol: bitarray(format(value, f'0{length}b')) for symbol, (value, length) in codes.items() if length}
+    return decodetree(codes) if codes else None
 
-    compression_ratio = original_size / compressed_size if compressed_size != 0 else 0
+def decode_packed(data, bit_count, decoder):
+    return b''.join(iter_decode_packed(data, bit_count, decoder))
+
+def iter_decode_packed(data, bit_count, decoder, chunk_size=CHUNK_SIZE):
+    # yields the decoded output in pieces of about chunk_size bytes
+    return iter_decode_chunks([data], len(data) * 8 - bit_count, decoder, chunk_size)
+
+def incomplete_code_start(error):
+    # bit position of a code cut off by the end of the bitarray, None for any other decode error
+    match = re.fullmatch(r"incomplete prefix code at position (\d+)", str(error))
+    return int(match.group(1)) if match else None
+
+def iter_decode_chunks(chunks, padding, decoder, chunk_size=CHUNK_SIZE):
+    # decodes a bit stream that arrives as an iterable of byte chunks; the last
+    # padding bits of the last chunk are not data. A code cut off at the end of
+    # a chunk is carried over and finished with the next one
+    bits = bitarray()
+    chunks = iter(chunks)
+    following = next(chunks, b'')
+    final = False
+
+    while not final:
+        bits.frombytes(following)
+        following = next(chunks, None)
+        final = following is None
+        if final and padding:
+            del bits[max(0, len(bits) - padding):]
+        if not bits:
+            continue
+        if decoder is None:
+            raise ValueError("Failed to decode: invalid Huffman code")
+
+        symbols = iter(bits.decode(decoder))  # a list before bitarray 3, islice needs one iterator
+        carry = None  # start of a cut off code
+        while True:
+            # list.extend keeps what was decoded before an error, so the last
+            # piece survives when the chunk ends inside a code
+            piece = []
+            try:
+                piece.extend(islice(symbols, chunk_size))
+            except ValueError as e:
+                carry = incomplete_code_start(e)
+                if carry is None:
+                    raise ValueError("Failed to decode: invalid Huffman code") from e
+                if final:
+                    raise ValueError("Failed to decode: truncated Huffman data") from e
+            if not piece:
+                break
+            yield bytes(piece)
+            if carry is not None:
+                break
+        del symbols
+        bits = bits[carry:] if carry is not None else bitarray()
+
+def encode_with_codes(data, codes):
+    # (payload, padding) from canonical codes, on the numpy path when it applies
+    if USE_NUMPY and len(data) >= NUMPY_MIN_SIZE and max(length for _, length in codes.values()) <= 32:
+        return encode_data_numpy(data, codes)
+    code_map = {symbol: format(value, f'0{length}b') for symbol, (value, length) in codes.items()}
+    return encode_data(data, code_map)
+
+def encode_block(data):
+    header, payload = encode_block_parts(data)
+    return header + payload
+
+def encode_block_parts(data):
+    # padding byte plus packed code lengths, and the payload
+    with stage("huffman.frequency"):
+        freq_table = build_frequency_table(data)
+    with stage("huffman.tree"):
+        lengths = {}
+        if freq_table:
+            root = build_huffman_tree(freq_table)
+            lengths = {symbol: len(code) for symbol, code in generate_codes(root).items()}
+        codes = canonical_codes(lengths)
+    with stage("huffman.encode"):
+        byte_array, padding = encode_with_codes(data, codes)
+    count("huffman.symbols_in", len(data))
+    count("huffman.distinct_symbols", len(lengths))
+    return bytes([padding]) + pack_code_lengths(lengths), byte_array
+
+def decode_block(block):
+    return b''.join(iter_decode_block(block))
+
+def iter_decode_block(block):
+    padding = block[0]
+    with stage("huffman.decode_tree"):
+        lengths, pos = unpack_code_lengths(block, 1)
+        decoder = build_decode_tree(canonical_codes(lengths))
+    data = block[pos:]
+    return timed("huffman.decode", iter_decode_packed(data, len(data) * 8 - padding, decoder))
 
-    print(f"Compressed '{input_path}' : '{output_path}'")
-    print(f"Time taken: {end_time - start_time:.4f} seconds")
-    print(f"Original size: {original_size} bytes")
-    print(f"Compressed size: {compressed_size} bytes")
-    print(f"diff in size: {original_size - compressed_size} bytes")
-    print(f"Compression ratio: {compression_ratio:.2f}")
+def map_blocks(func, blocks, workers):
+    # results come back lazily and in order
+    if workers <= 1 or len(blocks) <= 1:
+        yield from map(func, blocks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from map(instrument.merged, pool.map(instrument.worker(func), blocks))
 
-def decompress(input_path, output_path):
+def compress_bytes(data, block_size=None, workers=1):
+    return b''.join(compress_parts(data, block_size, workers))
+
+def compress_parts(data, block_size=None, workers=1):
+    # the compressed file as a list of buffers, so callers can write them without joining
+    if block_size is None and workers > 1:
+        block_size = DEFAULT_BLOCK_SIZE
+
+    if block_size is None:
+        return [FORMAT_MAGIC + bytes([FORMAT_VERSION]), *encode_block_parts(data)]
+
+    blocks = [bytes(data[i:i + block_size]) for i in range(0, len(data), block_size)]
+    encoded_blocks = list(map_blocks(encode_block, blocks, workers))
+
+    # block index: absolute offset of every block, plus the end of the last one
+    offset = 3 + 1 + 4 + 4 + 8 * (len(encoded_blocks) + 1)
+    offsets = []
+    for block in encoded_blocks:
+        offsets.append(offset)
+        offset += len(block)
+    offsets.append(offset)
+
+    header = (FORMAT_MAGIC + bytes([BLOCK_FORMAT_VERSION])
+              + block_size.to_bytes(4, 'big')
+              + len(encoded_blocks).to_bytes(4, 'big')
+              + b''.join(o.to_bytes(8, 'big') for o in offsets))
+    return [header, *encoded_blocks]
+
+def decompress_bytes(raw, workers=1):
+    return b''.join(iter_decompress(raw, workers))
+
+def iter_decompress(raw, workers=1):
+    if raw[:3] == FORMAT_MAGIC:
+        version = raw[3]
+        if version == FORMAT_VERSION:
+            return iter_decode_block(raw[4:])
+        if version == BLOCK_FORMAT_VERSION:
+            num_blocks = int.from_bytes(raw[8:12], 'big')
+            offsets = [int.from_bytes(raw[12 + 8 * i:20 + 8 * i], 'big') for i in range(num_blocks + 1)]
+            blocks = [bytes(raw[offsets[i]:offsets[i + 1]]) for i in range(num_blocks)]
+            return map_blocks(decode_block, blocks, workers)
+        raise ValueError(f"Unsupported Huffman format version: {version}")
+
+    # legacy layout: 4-byte header size followed by a JSON code_map
+    header_size = int.from_bytes(raw[:4], 'big')
+    header = json.loads(bytes(raw[4:4 + header_size]))
+    padding = header['padding']
+    codes = {int(k): (int(v, 2) if v else 0, len(v)) for k, v in header['code_map'].items()}
+    data = raw[4 + header_size:]
+    decoder = build_decode_tree(codes)
+    return timed("huffman.decode", iter_decode_packed(data, len(data) * 8 - padding, decoder))
+
+def read_exact(src, size):
+    # raw pipes may return short reads
+    data = src.read(size)
+    while len(data) < size:
+        more = src.read(size - len(data))
+        if not more:
+            raise ValueError("Truncated Huffman data")
+        data += more
+    return data
+
+def read_chunks(src, size=CHUNK_SIZE):
+    while True:
+        chunk = src.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+def iter_decompress_stream(src, workers=1):
+    # like iter_decompress, but pulls the compressed data from a file object
+    # (a pipe is fine) as it decodes instead of needing all of it up front
+    head = read_exact(src, 4)
+    if head[:3] == FORMAT_MAGIC:
+        version = head[3]
+        if version == FORMAT_VERSION:
+            padding = read_exact(src, 1)[0]
+            bounds = read_exact(src, 2)
+            table = bounds + read_exact(src, max(0, bounds[1] - bounds[0] + 1))
+            with stage("huffman.decode_tree"):
+                decoder = build_decode_tree(canonical_codes(unpack_code_lengths(table)[0]))
+            return timed("huffman.decode", iter_decode_chunks(read_chunks(src), padding, decoder))
+        if version == BLOCK_FORMAT_VERSION:
+            num_blocks = int.from_bytes(read_exact(src, 8)[4:], 'big')
+            index = read_exact(src, 8 * (num_blocks + 1))
+            offsets = [int.from_bytes(index[8 * i:8 * i + 8], 'big') for i in range(num_blocks + 1)]
+            blocks = (read_exact(src, offsets[i + 1] - offsets[i]) for i in range(num_blocks))
+            if workers > 1:
+                blocks = list(blocks)  # the pool reads ahead anyway
+            return map_blocks(decode_block, blocks, workers)
+        raise ValueError(f"Unsupported Huffman format version: {version}")
+
+    # legacy layout: 4-byte header size followed by a JSON code_map
+    header = json.loads(read_exact(src, int.from_bytes(head, 'big')))
+    codes = {int(k): (int(v, 2) if v else 0, len(v)) for k, v in header['code_map'].items()}
+    decoder = build_decode_tree(codes)
+    return timed("huffman.decode", iter_decode_chunks(read_chunks(src), header['padding'], decoder))
+
+def compress(input_path, output_path, block_size=None, workers=1):
     start_time = time.time()
+    data = map_file(input_path)
+    original_size = len(data)
+
+    compressed_size = write_chunks(output_path, compress_parts(data, block_size, workers))
 
-    with open(input_path, 'rb') as f:
-        header_size = int.from_bytes(f.read(4), 'big')
-        header = json.loads(f.read(header_size))
-        code_map = header['code_map']
-        padding = header['padding']
-        data = f.read()
+    end_time = time.time()
 
-    bitstring = ''.join(f'{byte:08b}' for byte in data)
-    bitstring = bitstring[:-padding] if padding else bitstring
+    compression_ratio = original_size / compressed_size if compressed_size != 0 else 0
 
-    tree = rebuild_tree_from_code_map(code_map)
-    decoded = decode_bits(bitstring, tree)
+    log = sys.stderr if output_path == STDIO else sys.stdout
+    print(f"Compressed '{input_path}' : '{output_path}'", file=log)
+    print(f"Time taken: {end_time - start_time:.4f} seconds", file=log)
+    print(f"Original size: {original_size} bytes", file=log)
+    print(f"Compressed size: {compressed_size} bytes", file=log)
+    print(f"diff in size: {original_size - compressed_size} bytes", file=log)
+    print(f"Compression ratio: {compression_ratio:.2f}", file=log)
 
-    with open(output_path, 'wb') as f:
-        f.write(decoded)
+def decompress(input_path, output_path, workers=1):
+    start_time = time.time()
+
+    if input_path == STDIO:
+        chunks = iter_decompress_stream(sys.stdin.buffer, workers)
+    else:
+        chunks = iter_decompress(map_file(input_path), workers)
+    decompressed_size = write_chunks(output_path, chunks)
 
     end_time = time.time()
 
-    print(f"Decompressed '{input_path}' : '{output_path}'")
-    print(f"Time taken: {end_time - start_time:.4f} seconds")
-    print(f"Decompressed size: {len(decoded)} bytes")
+    log = sys.stderr if output_path == STDIO else sys.stdout
+    print(f"Decompressed '{input_path}' : '{output_path}'", file=log)
+    print(f"Time taken: {end_time - start_time:.4f} seconds", file=log)
+    print(f"Decompressed size: {decompressed_size} bytes", file=log)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Huffman Compression Tool")
     parser.add_argument("mode", choices=["compress", "decompress"], help="Mode of operation")
-    parser.add_argument("input", help="Input file path")
-    parser.add_argument("output", help="Output file path (.huff for compress, original ext for decompress)")
+    parser.add_argument("input", help="Input file path, '-' for stdin")
+    parser.add_argument("output", help="Output file path (.huff for compress, original ext for decompress), '-' for stdout")
+    parser.add_argument("--block-size", type=int, default=None,
+                        help=f"Compress in independent blocks of this many bytes (default with --workers > 1: {DEFAULT_BLOCK_SIZE})")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes for block mode (default: 1)")
+    parser.add_argument("--no-numpy", action="store_true", help="Use the pure-Python encoder even if NumPy is installed")
+    instrument.add_arguments(parser)
 
     args = parser.parse_args()
+    instrument.configure(args)
+    if args.no_numpy:
+        USE_NUMPY = False
 
     if args.mode == "compress":
-        compress(args.input, args.output)
+        compress(args.input, args.output, args.block_size, args.workers)
     else:
-        decompress(args.input, args.output)
+        decompress(args.input, args.output, args.workers)
 
     import sys
     sys.exit(0)  # explicitly exit with success status if no errors occurred
@@ -0,0 +1,172 @@
+import atexit
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import time
+from collections import defaultdict
+
+# HAC_METRICS=<path> (or '-' for stderr) turns metrics on for any entry point,
+# HAC_PROFILE=1 adds a cProfile summary to the report
+METRICS_ENV = "HAC_METRICS"
+PROFILE_ENV = "HAC_PROFILE"
+PROFILE_TOP = 25
+
+ENABLED = False
+_stages = defaultdict(lambda: [0, 0])  # name -> [calls, nanoseconds]
+_counters = defaultdict(int)
+_profiler = None
+_output = None
+
+
+class Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        entry = _stages[self.name]
+        entry[0] += 1
+        entry[1] += time.perf_counter_ns() - self.start
+
+
+class NullStage:
+    # shared no-op returned while metrics are off
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+def stage(name):
+    # with stage("huffman.encode"): ... adds the block's wall time to that stage
+    return Stage(name) if ENABLED else NULL_STAGE
+
+def timed(name, iterable):
+    # times the work done inside the iterator itself, not in whoever consumes it
+    return _timed(name, iterable) if ENABLED else iterable
+
+def _timed(name, iterable):
+    entry = _stages[name]
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter_ns()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            entry[1] += time.perf_counter_ns() - start
+            return
+        entry[0] += 1
+        entry[1] += time.perf_counter_ns() - start
+        yield item
+
+def count(name, value=1):
+    if ENABLED:
+        _counters[name] += value
+
+def worker(func):
+    # wraps a process pool task so the stages and counters it records in the
+    # worker come back with its result; the parent unwraps them with merged()
+    return functools.partial(_run_worker, ENABLED, func)
+
+def _run_worker(enabled, func, *args):
+    global ENABLED
+    ENABLED = enabled
+    reset()  # a forked worker starts with a copy of the parent's totals
+    result = func(*args)
+    if not enabled:
+        return result, None
+    return result, ({name: list(entry) for name, entry in _stages.items()}, dict(_counters))
+
+def merged(item):
+    result, snapshot = item
+    if snapshot is not None:
+        stages, counters = snapshot
+        for name, (calls, ns) in stages.items():
+            entry = _stages[name]
+            entry[0] += calls
+            entry[1] += ns
+        for name, value in counters.items():
+            _counters[name] += value
+    return result
+
+def enable(output="-", profile=False):
+    global ENABLED, _output, _profiler
+    if not ENABLED:
+        atexit.register(emit)
+    ENABLED = True
+    _output = output
+    if profile and _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+
+def report():
+    result = {
+        "stages": {name: {"calls": calls, "seconds": ns / 1e9} for name, (calls, ns) in sorted(_stages.items())},
+        "counters": dict(sorted(_counters.items())),
+    }
+    if _profiler is not None:
+        _profiler.disable()
+        stats = pstats.Stats(_profiler).sort_stats("cumulative")
+        rows = []
+        for (filename, line, func), (_, calls, total, cumulative, _) in list(stats.stats.items()):
+            rows.append({
+                "function": f"{os.path.basename(filename)}:{line}({func})",
+                "calls": calls,
+                "total_seconds": total,
+                "cumulative_seconds": cumulative,
+            })
+        rows.sort(key=lambda row: row["cumulative_seconds"], reverse=True)
+        result["profile"] = rows[:PROFILE_TOP]
+        _profiler.enable()
+    return result
+
+def emit():
+    # writes the report once; later calls (the atexit hook after an explicit emit) do nothing
+    global ENABLED, _profiler
+    if not ENABLED:
+        return
+    data = report()
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler = None
+    ENABLED = False
+    if _output in (None, "-"):
+        json.dump(data, sys.stderr, indent=2)
+        sys.stderr.write("\n")
+    else:
+        with open(_output, "w") as f:
+            json.dump(data, f, indent=2)
+            f.write("\n")
+
+def add_arguments(parser):
+    parser.add_argument("--metrics", metavar="PATH", default=None,
+                        help=f"Write stage timings and counters as JSON ('-' for stderr, or set {METRICS_ENV})")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"Include a cProfile summary in the metrics (or set {PROFILE_ENV}=1)")
+
+def configure(args=None):
+    # command-line flags win over the environment
+    output = getattr(args, "metrics", None) or os.environ.get(METRICS_ENV)
+    profile = getattr(args, "profile", False) or os.environ.get(PROFILE_ENV) == "1"
+    if output or profile:
+        enable(output or "-", profile)
+
+
+configure()
@@ -0,0 +1,184 @@
+from array import array
+
+from instrument import count, stage
+
+# match/literal parse feeding the entropy coders (see the lz+* codecs in api.py).
+# Each sequence is a literal run followed by a match; its lengths go into one
+# token byte, LZ4 style (literal run << 4 | match length - MIN_MATCH, 15 meaning
+# "more in the extra stream"), and every field type gets a stream of its own so
+# an order-0 coder sees one skewed distribution per stream
+MIN_MATCH = 4
+WINDOW = 1 << 16
+MAX_MATCH = 1 << 16
+MAX_CHAIN = 16  # candidates tried per position
+LAZY_LIMIT = 32  # matches this long are taken without looking one byte ahead
+COMPARE_STEP = 32
+STREAMS = ("tokens", "literals", "extra", "offsets_hi", "offsets_lo")
+
+
+def put_length(extra, value):
+    # the part of a run or match length that did not fit in its 4-bit field
+    while value >= 255:
+        extra.append(255)
+        value -= 255
+    extra.append(value)
+
+def longest_match(data, i, candidate, chain, n):
+    # (length, position) of the longest match for data[i:] among the first
+    # MAX_CHAIN candidates of its chain, (0, -1) if none is in the window
+    length = 0
+    match = -1
+    end = min(n - i, MAX_MATCH)
+    tries = MAX_CHAIN
+    while candidate >= 0 and i - candidate <= WINDOW and tries:
+        tries -= 1
+        # a longer match has to agree on the byte just past the current best
+        if length < end and data[candidate + length] == data[i + length]:
+            size = MIN_MATCH
+            while size + COMPARE_STEP <= end and \
+                    data[i + size:i + size + COMPARE_STEP] == data[candidate + size:candidate + size + COMPARE_STEP]:
+                size += COMPARE_STEP
+            while size < end and data[i + size] == data[candidate + size]:
+                size += 1
+            if size > length:
+                length = size
+                match = candidate
+                if size == end:
+                    break
+        candidate = chain[candidate]
+    return length, match
+
+def parse(data):
+    # returns the streams as bytearrays in STREAMS order
+    data = bytes(data)
+    n = len(data)
+    tokens = bytearray()
+    literals = bytearray()
+    extra = bytearray()
+    offsets_hi = bytearray()
+    offsets_lo = bytearray()
+    # head: most recent position of each 4-byte key, chain[j]: the position
+    # before j with the same key; every position is inserted exactly once
+    head = {}
+    chain = array('l', [-1]) * max(n, 1)
+    matches = 0
+
+    def insert(j):
+        key = data[j:j + MIN_MATCH]
+        chain[j] = head.get(key, -1)
+        head[key] = j
+        return chain[j]
+
+    anchor = 0  # first byte of the pending literal run
+    i = 0
+    limit = n - MIN_MATCH
+    while i <= limit:
+        length, match = longest_match(data, i, insert(i), chain, n)
+        if not length:
+            i += 1
+            continue
+        # lazy matching: while the match starting one byte later is longer,
+        # emit this byte as a literal and take that one instead
+        indexed = i
+        while length < LAZY_LIMIT and i < limit:
+            indexed = i + 1
+            next_length, next_match = longest_match(data, i + 1, insert(i + 1), chain, n)
+            if next_length <= length:
+                break
+            i += 1
+            length, match = next_length, next_match
+
+        run = i - anchor
+        token_len = length - MIN_MATCH
+        tokens.append((min(run, 15) << 4) | min(token_len, 15))
+        if run >= 15:
+            put_length(extra, run - 15)
+        literals += data[anchor:i]
+        if token_len >= 15:
+            put_length(extra, token_len - 15)
+        distance = i - match - 1
+        offsets_hi.append(distance >> 8)
+        offsets_lo.append(distance & 255)
+        matches += 1
+
+        # index the matched bytes too so later repeats can find them
+        for j in range(indexed + 1, min(i + length, limit + 1)):
+            insert(j)
+        i += length
+        anchor = i
+
+    if anchor < n:
+        run = n - anchor
+        tokens.append(min(run, 15) << 4)
+        if run >= 15:
+            put_length(extra, run - 15)
+        literals += data[anchor:]
+    count("lz77.matches", matches)
+    count("lz77.literals", len(literals))
+    return tokens, literals, extra, offsets_hi, offsets_lo
+
+def get_length(extra, pos):
+    value = 0
+    while True:
+        byte = extra[pos]
+        pos += 1
+        value += byte
+        if byte != 255:
+            return value, pos
+
+def unparse(tokens, literals, extra, offsets_hi, offsets_lo, num_bytes):
+    out = bytearray()
+    lit_pos = 0
+    extra_pos = 0
+    for index, token in enumerate(tokens):
+        run = token >> 4
+        if run == 15:
+            more, extra_pos = get_length(extra, extra_pos)
+            run += more
+        out += literals[lit_pos:lit_pos + run]
+        lit_pos += run
+        if len(out) >= num_bytes:
+            break
+
+        length = token & 15
+        if length == 15:
+            more, extra_pos = get_length(extra, extra_pos)
+            length += more
+        length += MIN_MATCH
+        distance = (offsets_hi[index] << 8 | offsets_lo[index]) + 1
+        start = len(out) - distance
+        if start < 0:
+            raise ValueError("Invalid LZ77 match offset")
+        if distance >= length:
+            out += out[start:start + length]
+        else:
+            # overlapping match: the last `distance` bytes repeat
+            pattern = out[start:]
+            out += (pattern * (length // distance + 1))[:length]
+    if len(out) != num_bytes:
+        raise ValueError("Truncated LZ77 data")
+    return bytes(out)
+
+
+def encode(data, coder):
+    # original size, then each stream as 4-byte length + coder output
+    with stage("lz77.parse"):
+        streams = parse(data)
+    out = [len(data).to_bytes(8, 'big')]
+    for stream in streams:
+        payload = coder.compress(bytes(stream))
+        out.append(len(payload).to_bytes(4, 'big'))
+        out.append(payload)
+    return b''.join(out)
+
+def decode(raw, coder):
+    num_bytes = int.from_bytes(raw[:8], 'big')
+    pos = 8
+    streams = []
+    for _ in STREAMS:
+        size = int.from_bytes(raw[pos:pos + 4], 'big')
+        pos += 4
+        streams.append(coder.decompress(raw[pos:pos + size]))
+        pos += size
+    with stage("lz77.unparse"):
+        return unparse(*streams, num_bytes)
@@ -1,37 +1,58 @@
 import time
 import os
 import argparse
+from array import array
+
+import instrument
+from instrument import count, stage
+
+FORMAT_MAGIC = b'LZW'
+FORMAT_VERSION = 2
+CLEAR_CODE = 256
+FIRST_CODE = 257
+MIN_BITS = 9
+CHECK_INTERVAL = 1 << 16  # input bytes between ratio checks once the dictionary is full
+CLEAR_THRESHOLD = 0.05  # relative ratio drop between checks that triggers a CLEAR
+READ_SIZE = 1 << 16
+OUTPUT_WINDOW = 1 << 20  # decoded bytes kept for copying recent phrases
+TABLE_GROWTH = 1 << 12  # decoder table entries added up front, then doubled as needed
+
+def read_full(infile, size):
+    # up to size bytes, fewer only at the end of the stream
+    data = infile.read(size)
+    while len(data) < size:
+        more = infile.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
 
 class LZWCompressor:
-    def __init__(self, max_dict_size=65535):
-        self.max_dict_size = max_dict_size # 2^16-1 --> 16 bits needed ~ 2 bytes
+    def __init__(self, max_bits=16, max_dict_size=65535, primer=()):
+        if not MIN_BITS <= max_bits <= 24:
+            raise ValueError(f"max_bits must be between {MIN_BITS} and 24")
+        self.max_bits = max_bits
+        self.max_dict_size = max_dict_size # legacy format only: 2^16-1 --> 16 bits needed ~ 2 bytes
+        # primer: (prefix code, byte) pairs preloaded as codes FIRST_CODE, FIRST_CODE + 1, ...
+        # after every CLEAR; both sides must use the same one (see models.py)
+        if FIRST_CODE + len(primer) >= 1 << max_bits:
+            raise ValueError("primer does not fit in the dictionary")
+        self.primer = list(primer)
+        self.primed = {}
+        for i, (prefix, byte) in enumerate(self.primer):
+            if not (0 <= prefix < FIRST_CODE + i and prefix != CLEAR_CODE and 0 <= byte < 256):
+                raise ValueError(f"Invalid primer entry {i}: {(prefix, byte)}")
+            self.primed[(prefix << 8) | byte] = FIRST_CODE + i
+        self.first_code = FIRST_CODE + len(self.primer)
+        self.first_width = max(MIN_BITS, (self.first_code - 1).bit_length())
 
 
     def lzw_compress(self, input_path, output_path):
         start_time = time.time()
-        dictionary = {bytes([i]): i for i in range(256)}
-        dict_size = 256
-        
         with open(input_path, 'rb') as infile, \
         open(output_path, 'wb') as outfile:
-            w = b""
-            while True:
-                c = infile.read(1)
-                if not c:
-                    break
-
-                wc = w + c
-                if wc in dictionary:
-                    w = wc
-                else:
-                    outfile.write(dictionary[w].to_bytes(2, 'big'))
-                    if dict_size < self.max_dict_size:
-                        dictionary[wc] = dict_size
-                        dict_size += 1
-                    w = c
-
-            if w: # to account for the last word if not written
-                outfile.write(dictionary[w].to_bytes(2, 'big'))
+            with stage("lzw.compress"):
+                self.compress_stream(infile, outfile)
 
         end_time = time.time()
         diff = end_time - start_time
@@ -47,43 +68,95 @@ class LZWCompressor:
         print(f"Compression ratio: {ratio:.2f}")
 
 
+    def compress_stream(self, infile, outfile):
+        max_bits = self.max_bits
+        max_size = 1 << max_bits
+        # keyed on (prefix_code << 8) | next_byte, so no phrase bytes are ever built
+        dictionary = dict(self.primed)
+        lookup = dictionary.get
+        dict_size = self.first_code
+        width = self.first_width
+
+        acc = 0
+        nbits = 0
+        out = bytearray()
+        written = 0
+        in_count = 0
+        last_ratio = 0
+
+        outfile.write(FORMAT_MAGIC + bytes([FORMAT_VERSION, max_bits]))
+
+        w = -1
+        while True:
+            chunk = infile.read(CHECK_INTERVAL)
+            if not chunk:
+                break
+            in_count += len(chunk)
+            bits_before = (written + len(out)) * 8 + nbits
+
+            start = 0
+            if w < 0:
+                w = chunk[0]
+                start = 1
+            for c in chunk[start:] if start else chunk:
+                key = (w << 8) | c
+                code = lookup(key)
+                if code is not None:
+                    w = code
+                    continue
+
+                acc = (acc << width) | w
+                nbits += width
+                if nbits >= 32:
+                    nbits -= 32
+                    out += (acc >> nbits).to_bytes(4, 'big')
+                    acc &= (1 << nbits) - 1
+                if dict_size < max_size:
+                    dictionary[key] = dict_size
+                    dict_size += 1
+                    if dict_size - 1 == 1 << width and width < max_bits:
+                        width += 1
+                w = c
+
+            if dict_size == max_size:
+                # dictionary is frozen: reset it once the ratio starts to drop
+                ratio = len(chunk) * 8 / max(1, (written + len(out)) * 8 + nbits - bits_before)
+                if ratio < last_ratio * (1 - CLEAR_THRESHOLD):
+                    for code in (w, CLEAR_CODE):
+                        acc = (acc << width) | code
+                        nbits += width
+                    dictionary.clear()
+                    dictionary.update(self.primed)
+                    count("lzw.clears")
+                    dict_size = self.first_code
+                    width = self.first_width
+                    last_ratio = 0
+                    w = -1
+                else:
+                    last_ratio = ratio
+
+            if len(out) >= CHECK_INTERVAL:
+                outfile.write(out)
+                written += len(out)
+                out.clear()
+
+        if w >= 0: # to account for the last word if not written
+            acc = (acc << width) | w
+            nbits += width
+        pad = -nbits % 8
+        out += (acc << pad).to_bytes((nbits + pad) // 8, 'big')
+        outfile.write(out)
+        count("lzw.bytes_in", in_count)
+        count("lzw.bytes_out", written + len(out) + 5)
+        return in_count, written + len(out) + 5
+
     def lzw_decompress(self, input_path, output_path):
         start_time = time.time()
-        dictionary = {i: bytes([i]) for i in range(256)}
-        dict_size = 256
-        total_bytes_written = 0  # Track decompressed size
 
         with open(input_path, 'rb') as infile, \
             open(output_path, 'wb') as outfile:
-            
-            data = infile.read()
-            if len(data) < 2: # because we saved the int into 2 bytes
-                return
-
-            # Read 2 bytes at a time and convert to integer
-            codes = [int.from_bytes(data[i:i+2], 'big') for i in range(0, len(data), 2)]
-            
-            # print(f'{codes=}')
-            
-            w = dictionary[codes[0]]
-            outfile.write(w)
-            total_bytes_written += len(w)
-
-            for k in codes[1:]:
-                if k in dictionary:
-                    entry = dictionary[k]
-                elif k == dict_size: # Special case: current code is not in dictionary yet
-                    entry = w + w[0:1]
-                else:
-                    raise ValueError(f"Invalid compressed code: {k}")
-
-                outfile.write(entry)
-
-                if dict_size < self.max_dict_size:
-                    # add new word in dictionary
-                    dictionary[dict_size] = w + entry[0:1] # entry[0:1] is the first char
-                    dict_size += 1
-                w = entry
+            with stage("lzw.decompress"):
+                total_bytes_written = self.decompress_stream(infile, outfile)
 
         end_time = time.time()
         diff = end_time - start_time
@@ -91,6 +164,139 @@ class LZWCompressor:
         print(f"Time taken: {diff:.4f} seconds")
         print(f"Decompressed size: {total_bytes_written} bytes")
 
+    def decompress_stream(self, infile, outfile):
+        head = read_full(infile, 5)
+        if head[:3] == FORMAT_MAGIC:
+            if head[3] != FORMAT_VERSION:
+                raise ValueError(f"Unsupported LZW format version: {head[3]}")
+            return self.decode_stream(infile, outfile, head[4])
+        # original format: raw 2-byte codes, dictionary frozen at max_dict_size
+        return self.decode_stream(infile, outfile, None, pending=head)
+
+    def decode_stream(self, infile, outfile, max_bits, pending=b''):
+        # max_bits=None selects the legacy fixed 16-bit layout without CLEAR
+        if max_bits is None:
+            first_code, clear_code, max_size = 256, -1, self.max_dict_size
+            width = 16
+        else:
+            first_code, clear_code, max_size = self.first_code, CLEAR_CODE, 1 << max_bits
+            width = self.first_width
+
+        # each entry is (prefix code, last byte, length) plus the stream offset
+        # where its phrase was last written, so recent phrases are copied out of
+        # the output window and older ones are rebuilt by walking the prefixes
+        # the tables grow with the dictionary, so a small stream written with a
+        # large max_bits stays small to decode
+        table_size = first_code + TABLE_GROWTH
+        prefix = array('i', [-1]) * table_size
+        last = bytearray(range(256)) + bytearray(table_size - 256)
+        length = array('i', [1]) * table_size
+        offset = array('q', [-1]) * table_size
+        for code, (prefix_code, byte) in enumerate(self.primer if max_bits is not None else (), FIRST_CODE):
+            prefix[code] = prefix_code
+            last[code] = byte
+            length[code] = length[prefix_code] + 1
+        dict_size = first_code
+
+        out = bytearray()
+        base = 0  # stream offset of out[0]
+        buf = pending
+        pos = 0
+        acc = 0
+        nbits = 0
+        prev = -1
+        prev_pos = 0
+
+        while True:
+            if nbits < width:
+                if pos + 4 <= len(buf):
+                    acc = (acc << 32) | int.from_bytes(buf[pos:pos + 4], 'big')
+                    pos += 4
+                    nbits += 32
+                else:
+                    # pipes may return short reads, only an empty read is the end
+                    chunk = True
+                    while nbits < width and chunk:
+                        chunk = infile.read(READ_SIZE)
+                        buf = buf[pos:] + chunk
+                        pos = 0
+                        while nbits < width and pos < len(buf):
+                            acc = (acc << 8) | buf[pos]
+                            pos += 1
+                            nbits += 8
+                    if nbits < width:
+                        if nbits >= 8 or acc:
+                            raise ValueError("Truncated LZW data")
+                        break  # only padding left
+            nbits -= width
+            k = acc >> nbits
+            acc &= (1 << nbits) - 1
+
+            if k == clear_code:
+                dict_size = first_code
+                width = self.first_width
+                prev = -1
+                continue
+
+            cur_pos = base + len(out)
+            if k < 256:
+                out.append(k)
+            elif k < dict_size:
+                start = offset[k] - base
+                if start >= 0:
+                    out += out[start:start + length[k]]
+                else:
+                    out += self.expand(k, prefix, last, length)
+                offset[k] = cur_pos
+            elif k == dict_size and prev >= 0: # Special case: current code is not in dictionary yet
+                start = prev_pos - base
+                phrase = out[start:start + length[prev]] if start >= 0 else self.expand(prev, prefix, last, length)
+                out += phrase
+                out.append(phrase[0])
+            else:
+                raise ValueError(f"Invalid compressed code: {k}")
+
+            if prev >= 0 and dict_size < max_size:
+                if dict_size == table_size:
+                    grow = min(table_size, max_size - table_size)
+                    prefix += array('i', [-1]) * grow
+                    last += bytearray(grow)
+                    length += array('i', [1]) * grow
+                    offset += array('q', [-1]) * grow
+                    table_size += grow
+                # new phrase = previous phrase + first byte of this one, which is
+                # exactly what now sits at prev_pos in the stream
+                prefix[dict_size] = prev
+                last[dict_size] = out[cur_pos - base]
+                length[dict_size] = length[prev] + 1
+                offset[dict_size] = prev_pos
+                dict_size += 1
+            if max_bits is not None:
+                # the encoder is one entry ahead of us, except once the dictionary is full
+                width = min(max_bits, max(self.first_width, dict_size.bit_length()))
+            prev = k
+            prev_pos = cur_pos
+
+            if len(out) >= 2 * OUTPUT_WINDOW:
+                cut = len(out) - OUTPUT_WINDOW
+                outfile.write(out[:cut])
+                del out[:cut]
+                base += cut
+
+        outfile.write(out)
+        count("lzw.bytes_decoded", base + len(out))
+        return base + len(out)
+
+    def expand(self, code, prefix, last, length):
+        phrase = bytearray(length[code])
+        i = len(phrase) - 1
+        while code >= 256:
+            phrase[i] = last[code]
+            code = prefix[code]
+            i -= 1
+        phrase[0] = code
+        return phrase
+
     def verify(self, original_path, decompressed_path):
         with open(original_path, 'rb') as f1, open(decompressed_path, 'rb') as f2:
             if f1.read() == f2.read():
@@ -105,9 +311,12 @@ if __name__ == "__main__":
     parser.add_argument("mode", choices=["compress", "decompress"], help="Mode")
     parser.add_argument("input", help="Input file path")
     parser.add_argument("output", help="Output file path")
+    parser.add_argument("--max-bits", type=int, default=16, help="Maximum code width in bits, 9-24 (default: 16)")
+    instrument.add_arguments(parser)
 
     args = parser.parse_args()
-    lzw = LZWCompressor()
+    instrument.configure(args)
+    lzw = LZWCompressor(args.max_bits)
 
     if args.mode == "compress":
         lzw.lzw_compress(args.input, args.output)
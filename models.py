@@ -0,0 +1,265 @@
+import argparse
+import functools
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from io import BytesIO
+
+import api
+import instrument
+from arithmetic import normalize_frequencies, rans_decode_chunks, rans_encode
+from fileio import map_file, write_chunks
+from huffman import (
+    build_decode_tree,
+    build_huffman_tree,
+    canonical_codes,
+    encode_with_codes,
+    generate_codes,
+    iter_decode_packed,
+)
+from instrument import count, stage
+from lzw import FIRST_CODE, LZWCompressor
+
+# a model-coded file: magic, version, backend id, first 8 bytes of the model's
+# SHA-256, original size, then the backend payload (no tables of its own)
+FORMAT_MAGIC = b'HAM'
+FORMAT_VERSION = 1
+HASH_SIZE = 8
+HEADER_SIZE = 3 + 1 + 1 + HASH_SIZE + 8
+BACKENDS = {"huffman": 1, "rans": 2, "lzw": 3}
+MODEL_VERSION = 1
+DEFAULT_PRIMER_SIZE = 4096
+MODEL_CACHE_SIZE = 16
+
+
+class Model:
+    # everything the backends need, built once per model file and kept in the cache
+
+    def __init__(self, raw):
+        self.hash = hashlib.sha256(raw).digest()[:HASH_SIZE]
+        spec = json.loads(raw)
+        if spec.get("version") != MODEL_VERSION:
+            raise ValueError(f"Unsupported model version: {spec.get('version')}")
+        self.frequencies = {symbol: freq for symbol, freq in enumerate(spec["frequencies"]) if freq}
+        self.rans_tables = normalize_frequencies(self.frequencies)
+        lengths = {symbol: length for symbol, length in enumerate(spec["huffman_lengths"]) if length}
+        self.huffman_codes = canonical_codes(lengths)
+        self.huffman_decoder = build_decode_tree(self.huffman_codes)
+        self.lzw = LZWCompressor(spec["lzw"]["max_bits"], primer=[tuple(entry) for entry in spec["lzw"]["primer"]])
+
+    def compress(self, data, backend="huffman"):
+        header = (FORMAT_MAGIC + bytes([FORMAT_VERSION, BACKENDS[backend]])
+                  + self.hash + len(data).to_bytes(8, 'big'))
+        with stage(f"models.{backend}.encode"):
+            if backend == "huffman":
+                payload, padding = encode_with_codes(data, self.huffman_codes)
+                return header + bytes([padding]) + payload
+            if backend == "rans":
+                return header + rans_encode(data, self.frequencies, self.rans_tables)
+            out = BytesIO()
+            self.lzw.compress_stream(BytesIO(data), out)
+            return header + out.getvalue()
+
+    def decompress_chunks(self, raw):
+        backend, num_bytes = parse_header(raw, self.hash)
+        payload = raw[HEADER_SIZE:]
+        if backend == "huffman":
+            return iter_decode_packed(payload[1:], (len(payload) - 1) * 8 - payload[0], self.huffman_decoder)
+        if backend == "rans":
+            return rans_decode_chunks(payload, self.frequencies, num_bytes, self.rans_tables)
+        out = BytesIO()
+        self.lzw.decompress_stream(BytesIO(payload), out)
+        return [out.getvalue()]
+
+    def decompress(self, raw):
+        with stage("models.decode"):
+            return b''.join(self.decompress_chunks(raw))
+
+
+def parse_header(raw, model_hash=None):
+    if raw[:3] != FORMAT_MAGIC:
+        raise ValueError("Not a model-coded file")
+    if raw[3] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported model-coded format version: {raw[3]}")
+    backends = {value: name for name, value in BACKENDS.items()}
+    if raw[4] not in backends:
+        raise ValueError(f"Unknown model backend id: {raw[4]}")
+    if model_hash is not None and bytes(raw[5:5 + HASH_SIZE]) != model_hash:
+        raise ValueError(f"File was coded with model {bytes(raw[5:5 + HASH_SIZE]).hex()}, not {model_hash.hex()}")
+    return backends[raw[4]], int.from_bytes(raw[5 + HASH_SIZE:HEADER_SIZE], 'big')
+
+def file_model_hash(raw):
+    parse_header(raw)
+    return bytes(raw[5:5 + HASH_SIZE])
+
+
+@functools.lru_cache(maxsize=MODEL_CACHE_SIZE)
+def _cached_model(path, mtime_ns, size):
+    # keyed on mtime and size too, so an edited model file is rebuilt
+    count("models.cache_misses")
+    with stage("models.load"), open(path, 'rb') as f:
+        return Model(f.read())
+
+def load_model(path):
+    stat = os.stat(path)
+    return _cached_model(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def find_model(location, model_hash):
+    # location is a model file or a directory of them
+    paths = [location]
+    if os.path.isdir(location):
+        paths = [os.path.join(location, name) for name in sorted(os.listdir(location)) if name.endswith(".json")]
+    for path in paths:
+        try:
+            model = load_model(path)
+        except (ValueError, KeyError):
+            if path == location:
+                raise
+            continue  # some other json file sharing the directory
+        if model.hash == model_hash:
+            return model
+    raise ValueError(f"No model with hash {model_hash.hex()} in {location}")
+
+
+def train_lzw_primer(data, size=DEFAULT_PRIMER_SIZE, max_bits=16):
+    # LZW-parse the corpus once, then keep the most used phrases together with
+    # every prefix they need, renumbered in creation order so prefixes come first
+    limit = (1 << max_bits) - FIRST_CODE
+    dictionary = {}
+    entries = []
+    uses = []
+    if data:
+        w = data[0]
+        for c in data[1:]:
+            key = (w << 8) | c
+            code = dictionary.get(key)
+            if code is not None:
+                w = code
+                continue
+            if w >= FIRST_CODE:
+                uses[w - FIRST_CODE] += 1
+            if len(entries) < limit:
+                dictionary[key] = FIRST_CODE + len(entries)
+                entries.append((w, c))
+                uses.append(0)
+            w = c
+
+    size = min(size, limit - 1)
+    chosen = set()
+    for index in sorted(range(len(entries)), key=lambda i: (-uses[i], i)):
+        if not uses[index]:
+            break
+        chain = []
+        while index >= 0 and index not in chosen:
+            chain.append(index)
+            index = entries[index][0] - FIRST_CODE
+        if len(chosen) + len(chain) > size:
+            continue
+        chosen.update(chain)
+
+    renumber = {}
+    primer = []
+    for index in sorted(chosen):
+        prefix, byte = entries[index]
+        renumber[index] = FIRST_CODE + len(primer)
+        primer.append([renumber.get(prefix - FIRST_CODE, prefix), byte])
+    return primer
+
+def train(paths, primer_size=DEFAULT_PRIMER_SIZE, max_bits=16):
+    spec = train_bytes(b''.join(bytes(map_file(path)) for path in paths), primer_size, max_bits)
+    spec["trained_on"] = [os.path.basename(path) for path in paths]
+    return spec
+
+def train_bytes(corpus, primer_size=DEFAULT_PRIMER_SIZE, max_bits=16):
+    counts = Counter(corpus)
+    # every byte stays codable, unseen ones just get long codes
+    frequencies = [counts.get(symbol, 0) + 1 for symbol in range(256)]
+    root = build_huffman_tree(dict(enumerate(frequencies)))
+    lengths = [0] * 256
+    for symbol, code in generate_codes(root).items():
+        lengths[symbol] = len(code)
+    return {
+        "version": MODEL_VERSION,
+        "training_bytes": len(corpus),
+        "frequencies": frequencies,
+        "huffman_lengths": lengths,
+        "lzw": {"max_bits": max_bits, "primer": train_lzw_primer(corpus, primer_size, max_bits) if primer_size else []},
+    }
+
+
+class ModelCodec(api.Codec):
+    # api codec bound to one model, e.g. api.register_codec("csv", ModelCodec("csv.json", "rans"))
+
+    def __init__(self, model_path, backend="huffman"):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend} (available: {', '.join(BACKENDS)})")
+        self.model_path = model_path
+        self.backend = backend
+
+    def compress(self, data):
+        return load_model(self.model_path).compress(data, self.backend)
+
+    def decompress(self, data):
+        return load_model(self.model_path).decompress(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared pretrained models for small files")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    train_parser = subparsers.add_parser("train", help="Build a model from sample files")
+    train_parser.add_argument("inputs", nargs="+", help="Training files")
+    train_parser.add_argument("-o", "--output", required=True, help="Model output path (.json)")
+    train_parser.add_argument("--primer-size", type=int, default=DEFAULT_PRIMER_SIZE,
+                              help=f"LZW phrases to preload (default: {DEFAULT_PRIMER_SIZE})")
+    train_parser.add_argument("--max-bits", type=int, default=16, help="LZW maximum code width (default: 16)")
+
+    compress_parser = subparsers.add_parser("compress", help="Compress files against a model")
+    compress_parser.add_argument("inputs", nargs="+", help="Input files, each written to <input>.ham")
+    compress_parser.add_argument("--model", required=True, help="Model file")
+    compress_parser.add_argument("--backend", choices=list(BACKENDS), default="huffman",
+                                 help="Coder that uses the model (default: huffman)")
+
+    decompress_parser = subparsers.add_parser("decompress", help="Decompress model-coded files")
+    decompress_parser.add_argument("inputs", nargs="+", help="Input .ham files, each written without the suffix")
+    decompress_parser.add_argument("--model", required=True, help="Model file or directory of models, matched by hash")
+
+    for subparser in (train_parser, compress_parser, decompress_parser):
+        instrument.add_arguments(subparser)
+
+    args = parser.parse_args()
+    instrument.configure(args)
+
+    start_time = time.time()
+    if args.mode == "train":
+        spec = train(args.inputs, args.primer_size, args.max_bits)
+        raw = json.dumps(spec).encode()
+        with open(args.output, 'wb') as f:
+            f.write(raw)
+        print(f"Trained '{args.output}' on {len(args.inputs)} files ({spec['training_bytes']} bytes)")
+        print(f"Model hash: {Model(raw).hash.hex()}")
+        print(f"LZW primer: {len(spec['lzw']['primer'])} phrases")
+    elif args.mode == "compress":
+        model = load_model(args.model)
+        original_size = compressed_size = 0
+        for path in args.inputs:
+            data = map_file(path)
+            original_size += len(data)
+            compressed_size += write_chunks(path + ".ham", [model.compress(data, args.backend)])
+        print(f"Compressed {len(args.inputs)} files with model {model.hash.hex()} ({args.backend})")
+        print(f"Original size: {original_size} bytes")
+        print(f"Compressed size: {compressed_size} bytes")
+        print(f"Compression ratio: {original_size / compressed_size if compressed_size else 0:.2f}")
+    else:
+        decompressed_size = 0
+        for path in args.inputs:
+            raw = map_file(path)
+            model = find_model(args.model, file_model_hash(raw))
+            output_path = path[:-4] if path.endswith(".ham") else path + ".out"
+            decompressed_size += write_chunks(output_path, model.decompress_chunks(raw))
+        print(f"Decompressed {len(args.inputs)} files")
+        print(f"Decompressed size: {decompressed_size} bytes")
+    print(f"Time taken: {time.time() - start_time:.4f} seconds", file=sys.stdout)
@@ -0,0 +1,236 @@
+import io
+import json
+import os
+import random
+
+import pytest
+
+import api
+import arithmetic
+import container
+import huffman
+import lz77
+import models
+from lzw import LZWCompressor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+with open(os.path.join(ROOT, "data", "iris.data.txt"), 'rb') as f:
+    IRIS = f.read()
+# about 30 KB of text, the iris lines in a fixed shuffled order
+TEXT = b''.join(random.Random(3).choices(IRIS.splitlines(keepends=True), k=1000))
+
+INPUTS = {
+    "empty": b'',
+    "one-byte": b'x',
+    "single-symbol": b'a' * 3000,
+    "all-256": bytes(range(256)) * 4,
+    "random": random.Random(1).randbytes(5000),
+    "text": TEXT[:6000],
+}
+
+
+class Dribble(io.RawIOBase):
+    # an unbuffered pipe: read(n) hands out at most step bytes, read() still reads to the end
+    def __init__(self, data, step=3):
+        self.data = data
+        self.pos = 0
+        self.step = step
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.data[self.pos:self.pos + min(len(buffer), self.step)]
+        buffer[:len(chunk)] = chunk
+        self.pos += len(chunk)
+        return len(chunk)
+
+
+@pytest.mark.parametrize("name", sorted(INPUTS))
+@pytest.mark.parametrize("codec", api.available_codecs())
+def test_codec_roundtrip(codec, name):
+    data = INPUTS[name]
+    assert api.decompress(api.compress(data, codec), codec) == data
+
+
+@pytest.mark.parametrize("codec", api.available_codecs())
+def test_stream_short_reads(codec):
+    data = INPUTS["text"]
+    packed = io.BytesIO()
+    result = api.compress_stream(io.BytesIO(data), packed, codec)
+    assert result.input_size == len(data)
+    assert result.output_size == len(packed.getvalue())
+
+    out = io.BytesIO()
+    result = api.decompress_stream(Dribble(packed.getvalue()), out, codec)
+    assert out.getvalue() == data
+    assert result.input_size == len(packed.getvalue())
+
+
+# files written by the original scripts, from the first 2000 bytes of data/iris.data.txt
+def legacy(name):
+    with open(os.path.join(DATA, name), 'rb') as f:
+        return f.read()
+
+def test_legacy_huffman():
+    assert huffman.decompress_bytes(legacy("iris_2000.huff")) == IRIS[:2000]
+
+def test_legacy_lzw():
+    assert api.decompress(legacy("iris_2000.lzw"), "lzw") == IRIS[:2000]
+
+def test_legacy_arithmetic():
+    decoder = arithmetic.ArithmeticCodingDecoder(None, None, 16, raw=legacy("iris_2000.arith"))
+    assert decoder.decode_bytes() == IRIS[:2000]
+
+
+def test_huffman_blocks_short_reads():
+    data = TEXT[:20000]
+    raw = huffman.compress_bytes(data, block_size=4096)
+    assert huffman.decompress_bytes(raw) == data
+    assert b''.join(huffman.iter_decompress_stream(Dribble(raw, step=7))) == data
+
+
+def test_lzw_truncated():
+    raw = api.compress(TEXT[:4000], "lzw")
+    with pytest.raises(ValueError):
+        api.decompress(raw[:len(raw) // 2], "lzw")
+
+
+def test_lzw_clear():
+    # the dictionary fills at 9 bits, the switch to random data drops the ratio
+    data = TEXT * 4 + random.Random(2).randbytes(1 << 17) + TEXT
+    lzw = LZWCompressor(9)
+    packed = io.BytesIO()
+    lzw.compress_stream(io.BytesIO(data), packed)
+    out = io.BytesIO()
+    LZWCompressor().decompress_stream(io.BytesIO(packed.getvalue()), out)
+    assert out.getvalue() == data
+
+
+@pytest.mark.parametrize("max_bits", [9, 12, 24])
+def test_lzw_primer(max_bits):
+    primer = models.train_lzw_primer(TEXT, 200, max_bits)
+    data = TEXT[-3000:]
+    packed = io.BytesIO()
+    LZWCompressor(max_bits, primer=primer).compress_stream(io.BytesIO(data), packed)
+    out = io.BytesIO()
+    LZWCompressor(primer=primer).decompress_stream(Dribble(packed.getvalue(), step=5), out)
+    assert out.getvalue() == data
+
+
+@pytest.mark.parametrize("order", [0, 1, 3])
+def test_ppm_header_keeps_order(order):
+    data = TEXT[:3000]
+    raw = api.ContextCodec(order=order, table_bits=12).compress(data)
+    # decoded with the default codec, order and table size come from the header
+    assert api.decompress(raw, "ppm") == data
+
+
+@pytest.mark.parametrize("coder", ["huffman", "range", "rans"])
+def test_lz77(coder):
+    data = TEXT[:8000] + INPUTS["random"] + TEXT[:8000]
+    assert lz77.decode(lz77.encode(data, api.get_codec(coder)), api.get_codec(coder)) == data
+
+
+@pytest.mark.parametrize("backend", sorted(models.BACKENDS))
+@pytest.mark.parametrize("name", ["empty", "all-256", "random", "text"])
+def test_model_roundtrip(backend, name):
+    model = models.Model(json.dumps(models.train_bytes(TEXT, 500)).encode())
+    data = INPUTS[name]
+    raw = model.compress(data, backend)
+    assert model.decompress(raw) == data
+
+    other = models.Model(json.dumps(models.train_bytes(TEXT[:1000], 0)).encode())
+    with pytest.raises(ValueError):
+        other.decompress(raw)
+
+
+def pack(data, codec="huffman", block_size=1000, reuse_model=None):
+    out = io.BytesIO()
+    container.compress_stream(io.BytesIO(data), out, codec, block_size, reuse_model)
+    return out.getvalue()
+
+@pytest.mark.parametrize("codec", ["huffman", "auto", "stored"])
+def test_container_read_range(codec):
+    data = TEXT[:9500]
+    reader = container.ContainerReader(pack(data, codec))
+    assert reader.size == len(data)
+    assert reader.num_blocks == 10
+    assert b''.join(reader.iter_blocks()) == data
+    for offset, length in [(0, 0), (0, 1), (999, 2), (1500, 4000), (9000, 10000), (9500, 5)]:
+        assert reader.read_range(offset, length) == data[offset:offset + length]
+
+def test_container_empty():
+    reader = container.ContainerReader(pack(b''))
+    assert reader.num_blocks == 0
+    assert reader.read_range(0, 10) == b''
+
+def test_container_crc():
+    raw = bytearray(pack(TEXT[:3000], "stored"))
+    raw[container.HEADER_SIZE + container.BLOCK_HEADER_SIZE + 10] ^= 1
+    reader = container.ContainerReader(raw)
+    with pytest.raises(ValueError, match="CRC"):
+        reader.read_block(0)
+    assert reader.read_block(1) == TEXT[1000:2000]
+
+
+@pytest.mark.parametrize("reuse_model", [None, "lzw", "huffman", "rans"])
+def test_container_append_tail(tmp_path, reuse_model):
+    log = tmp_path / "app.log"
+    packed = tmp_path / "app.hac"
+    log.write_bytes(TEXT[:5000])
+    container.pack(str(log), str(packed), "huffman", 2000, reuse_model)
+
+    data = TEXT[:5000]
+    for step in (300, 0, 2500, 1):
+        data += TEXT[len(data):len(data) + step]
+        log.write_bytes(data)
+        container.append(str(log), str(packed), reuse_model=reuse_model, tail=True)
+        reader = container.ContainerReader(packed.read_bytes())
+        assert reader.size == len(data)
+        assert b''.join(reader.iter_blocks()) == data
+        assert reader.read_range(4900, 500) == data[4900:5400]
+    codecs = {reader.block_info(i)["codec"] for i in range(reader.num_blocks)}
+    assert ("model" in codecs) == (reuse_model is not None)
+
+def test_container_append_whole_file(tmp_path):
+    part = tmp_path / "part"
+    packed = tmp_path / "all.hac"
+    part.write_bytes(TEXT[:1500])
+    container.pack(str(part), str(packed), "auto", 1000)
+    part.write_bytes(TEXT[1500:4000])
+    container.append(str(part), str(packed), codec="lzw")
+    reader = container.ContainerReader(packed.read_bytes())
+    assert b''.join(reader.iter_blocks()) == TEXT[:4000]
+    assert reader.block_info(reader.num_blocks - 1)["codec"] == "lzw"
+
+def test_container_append_failures(tmp_path):
+    log = tmp_path / "app.log"
+    packed = tmp_path / "app.hac"
+    log.write_bytes(TEXT[:3000])
+    container.pack(str(log), str(packed), "huffman", 1000)
+    before = packed.read_bytes()
+
+    # the log was rotated, it is now shorter than what the container holds
+    log.write_bytes(TEXT[:100])
+    with pytest.raises(ValueError, match="rotated"):
+        container.append(str(log), str(packed), tail=True)
+    assert packed.read_bytes() == before
+
+    class Broken(api.Codec):
+        name = "broken"
+        codec_id = 200
+
+        def compress_block(self, data):
+            raise RuntimeError("out of disk")
+
+    log.write_bytes(TEXT[:6000])
+    api.register_codec("broken", Broken(), 200)
+    try:
+        with pytest.raises(RuntimeError):
+            container.append(str(log), str(packed), codec="broken", tail=True)
+    finally:
+        del api._codecs["broken"], api._codec_ids[200]
+    assert packed.read_bytes() == before